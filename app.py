@@ -5,16 +5,7 @@ from utils.helper import auth, jwt
 from celery_config import celery
 from flask_cors import CORS
 from celery_config import env
-
-app = Flask(__name__)
-
-CORS(app, resources={
-    r"/*" : {
-    "origins":
-        "*"
-        }
-    }
-)
+from sqlalchemy.pool import NullPool
 
 celery.conf.update(
     task_serializer='json',
@@ -23,28 +14,71 @@ celery.conf.update(
     timezone='Asia/Kolkata',
     enable_utc=True,
     broker_connection_retry_on_startup=True,
+    beat_schedule={
+        'purge-blacklist-tokens': {'task': 'purge_blacklist_tokens', 'schedule': 3600.0},
+        'drain-outbox': {'task': 'drain_outbox', 'schedule': float(env['outbox-poll-seconds'])},
+    },
 	)
 
-app.config['SQLALCHEMY_DATABASE_URI'] = env['db']
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+def database_uri():
+    if not env['db-pgbouncer']:
+        return env['db']
+    # pgbouncer rejects the "options" startup parameter, so in that mode the schema comes from
+    # the role instead: ALTER ROLE <user> SET search_path = timechronos
+    return env['db'].split('?')[0]
+
+def engine_options():
+    if env['db-pgbouncer']:
+        # pgbouncer (transaction pooling) owns the server connections; keep none idle here
+        return {'poolclass': NullPool}
+
+    # db-max-connections is the budget for the whole web tier, split evenly between workers.
+    # A gthread worker never needs more connections than threads; a gevent worker can use its share.
+    per_worker = max(env['db-max-connections'] // env['web-workers'], 1)
+    concurrency = env['web-threads'] if env['web-worker-class'] == 'gthread' else per_worker
+    pool_size = min(concurrency, per_worker)
+    return {
+        'pool_size': pool_size,
+        'max_overflow': per_worker - pool_size,
+        'pool_timeout': env['db-pool-timeout'],
+        'pool_recycle': env['db-pool-recycle'],
+        'pool_pre_ping': True
+    }
+
+def create_app():
+    app = Flask(__name__)
+
+    CORS(app, resources={
+        r"/*" : {
+        "origins":
+            "*"
+            }
+        }
+    )
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options()
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-# JWT Configuration
-app.config['JWT_PRIVATE_KEY'] = env['jwt-private-key']
-app.config['JWT_PUBLIC_KEY'] = env['jwt-public-key']
-app.config['JWT_ALGORITHM'] = env['jwt-algo'] 
-app.config['JWT_BLACKLIST_ENABLED'] = True
-app.config['JWT_BLACKLIST_TOKEN_CHECKS'] = ['access', 'refresh']
+    # JWT Configuration
+    app.config['JWT_PRIVATE_KEY'] = env['jwt-private-key']
+    app.config['JWT_PUBLIC_KEY'] = env['jwt-public-key']
+    app.config['JWT_ALGORITHM'] = env['jwt-algo']
+    app.config['JWT_BLACKLIST_ENABLED'] = True
+    app.config['JWT_BLACKLIST_TOKEN_CHECKS'] = ['access', 'refresh']
 
-#JWT Token Expiration
-app.config['JWT_ACCESS_TOKEN_EXPIRES'] = env['jwt-access-token-expiration']
-app.config['JWT_REFRESH_TOKEN_EXPIRES'] = env['jwt-refresh-token-expiration']
+    #JWT Token Expiration
+    app.config['JWT_ACCESS_TOKEN_EXPIRES'] = env['jwt-access-token-expiration']
+    app.config['JWT_REFRESH_TOKEN_EXPIRES'] = env['jwt-refresh-token-expiration']
 
-db.init_app(app)
-jwt.init_app(app)
+    db.init_app(app)
+    jwt.init_app(app)
 
-app.register_blueprint(models)
-app.register_blueprint(api)
-app.register_blueprint(auth)
+    app.register_blueprint(models)
+    app.register_blueprint(api)
+    app.register_blueprint(auth)
+    return app
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', debug = True)
\ No newline at end of file
+    # Development server only; production runs gunicorn with gunicorn.conf.py
+    create_app().run(host='0.0.0.0', debug = True)
@@ -1,2 +1,21 @@
-from app import app, celery
-app.app_context().push()
\ No newline at end of file
+from app import create_app, celery
+app = create_app()
+app.app_context().push()
+
+if __name__ == '__main__':
+    # Standalone outbox drainer for deployments that do not run celery beat
+    import time
+    from utils.helper import OutboxHelper
+    from utils.models import db
+    from celery_config import env
+
+    outbox = OutboxHelper()
+    while True:
+        try:
+            sent = outbox.drain()
+        except Exception as e:
+            db.session.rollback()
+            print(f"An error occurred: {e}")
+            sent = 0
+        if not sent:
+            time.sleep(env['outbox-poll-seconds'])
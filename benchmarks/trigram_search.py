@@ -0,0 +1,69 @@
+"""Substring search latency before and after the pg_trgm GIN index.
+
+Seeds a throwaway schema with ROWS client-like names, times the ILIKE '%term%' filter
+used by the list endpoints as a sequential scan, adds the same GIN index that migration
+0001_trigram_name_indexes creates, and times it again.
+
+    python benchmarks/trigram_search.py [rows]
+"""
+import os, sys, statistics, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+from celery_config import db
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+TERMS = ['acme', 'ltd', 'f00d', 'zzzz']
+RUNS = 5
+SCHEMA = 'trgm_benchmark'
+
+def timed(cur, term):
+    samples = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        cur.execute("SELECT id, name FROM client WHERE name ILIKE %s", (f'%{term}%',))
+        cur.fetchall()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def plan(cur, term):
+    cur.execute("EXPLAIN SELECT id, name FROM client WHERE name ILIKE %s", (f'%{term}%',))
+    return cur.fetchone()[0]
+
+def main():
+    conn = psycopg2.connect(db)
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cur.execute(f"CREATE SCHEMA {SCHEMA}")
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cur.execute(f"SET search_path = {SCHEMA}, timechronos, public")
+
+        print(f"Seeding {ROWS} rows...")
+        cur.execute("CREATE TABLE client (id BIGINT PRIMARY KEY, name VARCHAR(100) NOT NULL)")
+        cur.execute("""
+            INSERT INTO client
+            SELECT n, (ARRAY['Acme', 'Globex', 'Initech', 'Umbrella', 'Stark'])[1 + n %% 5]
+                      || ' ' || substr(md5(n::text), 1, 12) || ' Ltd'
+            FROM generate_series(1, %s) AS n""", (ROWS,))
+        cur.execute("ANALYZE client")
+
+        before = {term: (timed(cur, term), plan(cur, term)) for term in TERMS}
+
+        cur.execute("CREATE INDEX ix_client_name_trgm ON client USING gin (name gin_trgm_ops)")
+        cur.execute("ANALYZE client")
+
+        after = {term: (timed(cur, term), plan(cur, term)) for term in TERMS}
+
+        print(f"{'term':<8}{'scan ms':>12}{'index ms':>12}{'speedup':>10}  plan after index")
+        for term in TERMS:
+            scan_ms, index_ms = before[term][0], after[term][0]
+            print(f"{term:<8}{scan_ms:>12.1f}{index_ms:>12.1f}{scan_ms / index_ms:>9.1f}x  {after[term][1]}")
+    finally:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cur.close()
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Insert throughput and index size: random UUIDv4 keys vs time-ordered UUIDv7 keys.
+
+Seeds a throwaway schema with two taskhours-shaped tables holding SEED rows each: the old
+layout (uuid4 primary key plus the redundant UNIQUE (id) index) and the new one (uuid7 primary
+key only). It then times inserting ROWS more rows in batches and reports throughput and the
+total size of each table's indexes.
+
+    python benchmarks/uuid_keys.py [rows] [seed]
+"""
+import os, sys, time, uuid
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+from psycopg2.extras import execute_values
+from celery_config import db
+from utils.models import uuid7
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+SEED = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000
+BATCH = 1000
+SCHEMA = 'uuid_benchmark'
+
+LAYOUTS = {
+    'uuid4 + unique': (uuid.uuid4, "id UUID PRIMARY KEY, UNIQUE (id)"),
+    'uuid7': (uuid7, "id UUID PRIMARY KEY"),
+}
+
+def insert(cur, table, generate, rows):
+    start = time.perf_counter()
+    for offset in range(0, rows, BATCH):
+        batch = [(str(generate()), [0] * 7) for _ in range(min(BATCH, rows - offset))]
+        execute_values(cur, f'INSERT INTO {table} (id, "values") VALUES %s', batch)
+    return time.perf_counter() - start
+
+def index_bytes(cur, table):
+    cur.execute("""
+        SELECT coalesce(sum(pg_relation_size(indexrelid)), 0) FROM pg_index
+        WHERE indrelid = %s::regclass""", (table,))
+    return cur.fetchone()[0]
+
+def main():
+    conn = psycopg2.connect(db)
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cur.execute(f"CREATE SCHEMA {SCHEMA}")
+        cur.execute(f"SET search_path = {SCHEMA}")
+
+        results = {}
+        for number, (name, (generate, key)) in enumerate(LAYOUTS.items()):
+            table = f"taskhours_{number}"
+            cur.execute(f'CREATE TABLE {table} ({key}, "values" INTEGER[] NOT NULL)')
+
+            print(f"Seeding {SEED} rows into {table} ({name})...")
+            insert(cur, table, generate, SEED)
+            cur.execute(f"ANALYZE {table}")
+
+            elapsed = insert(cur, table, generate, ROWS)
+            results[name] = (ROWS / elapsed, index_bytes(cur, table))
+
+        print(f"{'layout':<16}{'rows/s':>12}{'index MB':>12}")
+        for name, (throughput, size) in results.items():
+            print(f"{name:<16}{throughput:>12.0f}{size / 1024 / 1024:>12.1f}")
+    finally:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cur.close()
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+# Production server: gunicorn (picks this file up from the working directory)
+#
+#     gunicorn
+#
+# Worker and thread counts come from config.py so the database pool sizing in
+# app.engine_options() is derived from the same numbers.
+from celery_config import env
+
+wsgi_app = 'wsgi:app'
+bind = env['web-bind']
+workers = env['web-workers']
+worker_class = env['web-worker-class']
+threads = env['web-threads']
+worker_connections = 1000
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+max_requests = 10000
+max_requests_jitter = 1000
+
+# Each worker builds its own app, engine and pool after forking; nothing is shared with the master
+preload_app = False
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        # psycopg2 blocks the whole hub unless it is told to yield to gevent
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            server.log.warning("psycogreen is not installed; database calls will block gevent workers")
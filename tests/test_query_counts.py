@@ -0,0 +1,90 @@
+# Statement-count checks for endpoints that were collapsed into a single query.
+# Needs the local Postgres from config.py; skipped when it (or the app's dependencies) is missing.
+#
+#     python -m pytest tests
+import uuid
+from datetime import date, timedelta
+
+import pytest
+
+create_app = pytest.importorskip('app').create_app
+
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from flask_jwt_extended import create_access_token
+from celery_config import create_schema
+from utils.models import db, Company, User, Client, Project, Task, Timesheet, TaskHours
+from utils.helper import TokenBlocklistHelper
+
+
+@pytest.fixture(scope='module')
+def app():
+    app = create_app()
+    with app.app_context():
+        try:
+            create_schema()
+            db.create_all()
+        except OperationalError as e:
+            pytest.skip(f'Postgres is not available: {e}')
+        yield app
+
+
+@pytest.fixture
+def timesheet(app):
+    suffix = uuid.uuid4().hex[:8]
+    company = Company(name=f'query-count-{suffix}')
+    db.session.add(company)
+    db.session.flush()
+
+    user = User(firstname='Query', lastname='Count', role='Admin', email=f'query-count-{suffix}@example.com',
+                gender='Other', company_id=company.id)
+    client = Client(name='Client', email=f'client-{suffix}@example.com', company_id=company.id)
+    db.session.add_all([user, client])
+    db.session.flush()
+
+    project = Project(name='Project', client_id=client.id)
+    db.session.add(project)
+    db.session.flush()
+
+    tasks = [Task(name=f'Task {number}', project_id=project.id) for number in range(3)]
+    start = date.today() - timedelta(days=date.today().weekday())
+    sheet = Timesheet(name='Week', start_date=start, end_date=start + timedelta(days=6), user_id=user.id)
+    db.session.add_all(tasks + [sheet])
+    db.session.flush()
+
+    db.session.add_all([TaskHours(task_id=task.id, timesheet_id=sheet.id, values=[1] * 7) for task in tasks])
+    db.session.commit()
+
+    token = create_access_token(identity=user.email, additional_claims={
+        'role': user.role, 'company_id': str(company.id), 'user_id': str(user.id)})
+    yield sheet, token
+
+    db.session.delete(company)
+    db.session.commit()
+
+
+def count_selects(app, call):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        response = call()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return response, [statement for statement in statements if statement.lstrip().upper().startswith('SELECT')]
+
+
+def test_taskhourslist_issues_one_select(app, timesheet, monkeypatch):
+    # The revocation check has its own Redis/Postgres path; only the endpoint's queries are counted
+    monkeypatch.setattr(TokenBlocklistHelper, 'is_revoked', lambda self, jti: False)
+    sheet, token = timesheet
+
+    response, selects = count_selects(app, lambda: app.test_client().post(
+        '/taskhourslist', json={'timesheet_id': str(sheet.id)}, headers={'Authorization': f'Bearer {token}'}))
+
+    assert response.status_code == 200
+    assert len(response.get_json()['taskhours']) == 3
+    assert len(selects) == 1, selects
@@ -0,0 +1,89 @@
+# send_queued_emails against a stub SES: only failed sends go back to SQS, malformed records are
+# dropped and a redelivered record whose dedup_key was already claimed is not sent again.
+#
+#     python -m pytest tests
+import json
+import threading
+
+import pytest
+
+send_queued_emails = pytest.importorskip('utils.helper').send_queued_emails
+
+
+class StubSes:
+    # Same signature as AwsHelper.send_email: returns an error string on failure, None on success
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def send_email(self, source, destination, subject, body_html):
+        if destination in self.failing:
+            return 'Throttling: Maximum sending rate exceeded.'
+        with self.lock:
+            self.sent.append(destination)
+
+
+class StubDedup:
+    # Same interface as EmailDedupHelper, kept in memory
+    def __init__(self):
+        self.claimed = set()
+        self.lock = threading.Lock()
+
+    def claim(self, dedup_key):
+        with self.lock:
+            if dedup_key in self.claimed:
+                return False
+            self.claimed.add(dedup_key)
+            return True
+
+    def release(self, dedup_key):
+        with self.lock:
+            self.claimed.discard(dedup_key)
+
+
+def record(message_id, destination):
+    body = {'source': 'contact@example.com', 'destination': destination, 'subject': 'Subject',
+            'body_html': '<p>Body</p>', 'dedup_key': f'key-{destination}'}
+    return {'messageId': message_id, 'body': json.dumps(body)}
+
+
+def send(records, ses, dedup, max_workers=2):
+    return send_queued_emails(records, ses, max_workers=max_workers, send_rate=1000, dedup=dedup)
+
+
+def test_partial_failure_reports_only_failed_sends():
+    ses = StubSes(failing={'bounce@example.com'})
+    records = [
+        record('1', 'one@example.com'),
+        record('2', 'bounce@example.com'),
+        record('3', 'three@example.com'),
+        {'messageId': '4', 'body': '{not json'},
+        {'messageId': '5', 'body': json.dumps({'destination': 'missing-keys@example.com'})},
+    ]
+
+    result = send(records, ses, StubDedup())
+
+    assert result == {'batchItemFailures': [{'itemIdentifier': '2'}]}
+    assert sorted(ses.sent) == ['one@example.com', 'three@example.com']
+
+
+def test_redelivered_record_is_not_sent_again():
+    ses = StubSes(failing={'bounce@example.com'})
+    dedup = StubDedup()
+    batch = [record('1', 'one@example.com'), record('2', 'bounce@example.com')]
+
+    assert send(batch, ses, dedup) == {'batchItemFailures': [{'itemIdentifier': '2'}]}
+
+    # The whole batch comes back (e.g. lambda_handler reported it all failed); SES has recovered
+    ses.failing.clear()
+    assert send([record('3', 'one@example.com'), record('4', 'bounce@example.com')], ses, dedup) == {'batchItemFailures': []}
+    assert sorted(ses.sent) == ['bounce@example.com', 'one@example.com']
+
+
+def test_all_sent():
+    ses = StubSes()
+    records = [record(str(number), f'{number}@example.com') for number in range(20)]
+
+    assert send(records, ses, StubDedup(), max_workers=4) == {'batchItemFailures': []}
+    assert len(ses.sent) == 20
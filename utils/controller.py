@@ -1,11 +1,29 @@
-from utils.helper import DbHelper, PasswordHelper, AuthenticationHelper, AuthorizationHelper, CodeHelper,  get_jwt_identity, jwt_required, AwsHelper, S3Helper
-from utils.models import db,User, Client, Project, Task, TaskHours, Company, Timesheet, DimDate, Approval, BlacklistToken, Token
-from flask import jsonify, request
-from sqlalchemy import func
+from utils.helper import DbHelper, PasswordHelper, AuthenticationHelper, AuthorizationHelper, CodeHelper,  get_jwt_identity, jwt_required, S3Helper, EmailHelper, OutboxHelper, TokenBlocklistHelper, PasswordPoolBusy, PaginationHelper, CounterHelper, search_pattern, CalendarHelper, ResponseCacheHelper, PrincipalHelper, ExportHelper, export_taskhours, ImportHelper, rebuild_company_counter
+from utils.models import db,User, Client, Project, Task, TaskHours, Company, Timesheet, Approval, Token, CompanyCounter, uuid7
+from flask import jsonify, request, current_app, stream_with_context
+from sqlalchemy import func, and_, or_, true, select, cast, literal, tuple_, Text, JSON
+from sqlalchemy.dialects.postgresql import insert, aggregate_order_by
+from datetime import datetime, date, timedelta
 from celery_config import env
-import json
 
 url = env['url']
+# Never taken from a request body: ids are fixed, tenancy comes from the token and archiving has its own endpoints
+protected_fields = {'id', 'company_id', 'is_archived'}
+
+def company_project(project_id, company_id):
+    # Projects and tasks carry no company_id; they are scoped to the caller's company through their client
+    return Project.query.join(Client, Project.client_id == Client.id).filter(
+        Project.id == project_id, Client.company_id == company_id, Project.is_archived == False).first()
+
+def company_task(task_id, company_id):
+    return Task.query.join(Project, Task.project_id == Project.id).join(Client, Project.client_id == Client.id).filter(
+        Task.id == task_id, Client.company_id == company_id, Task.is_archived == False).first()
+
+def project_counted(project):
+    # (counted, is_active) for CounterHelper.record_change: a project only counts while it and its client are live
+    client_archived = db.session.query(Client.is_archived).filter(Client.id == project.client_id).scalar()
+    return (not project.is_archived and not client_archived, project.is_active)
+
 class Controller:
 
     def __init__(self):
@@ -15,7 +33,6 @@ class Controller:
     def register(self):
         try:
             db_helper = DbHelper()
-            aws = AwsHelper()
             data = request.get_json()
             required_fields = ['company_name', 'firstname', 'email', 'password', 'gender', 'phone']
             if not data or not all(data.get(key) for key in required_fields):
@@ -29,8 +46,6 @@ class Controller:
             phone = data['phone']
             gender = data['gender']
             password = data['password']
-
-            hashed_password = self.password_helper.hash_password(password)
             
             existing_company = Company.query.filter_by(name=company_name, is_archived = False).first()
             if existing_company:
@@ -46,37 +61,26 @@ class Controller:
                 if not phone.isdigit():
                     return jsonify({'message': 'Invalid input: Please write correct no.', 'status': 400}), 400
 
-            company = Company(name=company_name)
-            db_helper.add_record(company)
-
-            user = User(firstname=firstname, lastname=lastname, role=role, email=email, phone=phone, gender=gender, password=hashed_password, company_id=company.id)
-            db_helper.add_record(user)
-            
-            reset_url = f"{url}/login"
-            subject = "Welcome to TimeChronos - Simplify your Time Management"
-            body_html = f"""
-                <h1>Welcome to TimeChronos!</h1>
-                <p>Thank you for signing up, {user.firstname}. We're excited to have you on board!</p>
-                <p>To get started, please log in to your account by clicking the link below:</p>
-                <p><a href="{reset_url}" style="color: #4CAF50; text-decoration: none;">{reset_url}</a></p>
-                <p>We hope TimeChronos will simplify your time management and enhance your productivity.</p>
-                <p>Best regards,</p>
-                <p>The TimeChronos Team</p>"""
-            
-            email_task = {
-                "source": 'contact@digitalshelfiq.com',
-                "destination": email,
-                "subject" : subject,
-                "body_html" : body_html
-            }
+            hashed_password = self.password_helper.hash_password(password)
 
-            aws.send_message(env['sqs_url'], message_body= json.dumps(email_task))
+            # One transaction: the company INSERT is flushed first only so the rows referencing it follow it
+            company = Company(name=company_name)
+            db.session.add(company)
+            db.session.flush()
 
+            # An admin supervises and approves themself; with the id known up front that is part of the INSERT
+            user = User(id=uuid7(), firstname=firstname, lastname=lastname, role=role, email=email, phone=phone, gender=gender, password=hashed_password, company_id=company.id)
             if user.role == 'Admin':
                 user.supervisor_id = user.id
                 user.approver_id = user.id
-                db_helper.update_record()
+            
+            email_task = EmailHelper().render('welcome.html', email, "Welcome to TimeChronos - Simplify your Time Management",
+                                              firstname=user.firstname)
+            OutboxHelper().add(email_task)
+            db_helper.add_record(user, CompanyCounter(company_id=company.id, total_employees=1, active_employees=1))
             return jsonify({'message': 'Company and user added successfully', 'status': 201})
+        except PasswordPoolBusy as e:
+            return jsonify({'message': str(e), 'status': 503}), 503
         except Exception as e:
             return jsonify({'message': str(e), 'status': 500}), 500
         
@@ -95,6 +99,10 @@ class Controller:
 
             if not self.password_helper.check_password(password, user.password):
                 return jsonify({'message': 'Incorrect email or password', 'status': 401}), 401
+
+            if self.password_helper.needs_rehash(user.password):
+                user.password = self.password_helper.hash_password(password)
+                DbHelper().update_record()
             
             claims = {
                 'user_name': user.firstname,
@@ -108,6 +116,8 @@ class Controller:
             return jsonify({'access_token': access_token,
                             'refresh_token': refresh_token,
                             'status': 200})
+        except PasswordPoolBusy as e:
+            return jsonify({'message': str(e), 'status': 503}), 503
         except Exception as e:
             return jsonify({'message': str(e), 'status': 500}), 500
         
@@ -131,7 +141,6 @@ class Controller:
         try:
             db_helper = DbHelper()
             code = CodeHelper()
-            aws = AwsHelper()
             data = request.get_json()
             if not data or 'email' not in data:
                 return jsonify({'message': 'Invalid input: email required', 'status': 400}), 400
@@ -142,24 +151,9 @@ class Controller:
                 return jsonify({'message': 'User not found', 'status': 404}), 404
 
             token = code.generate_reset_token(email)
-            reset_url = f"{url}/reset-password/{token}"
-
-            subject = "Password Reset Request"
-            body_html = f"""
-            <p>Dear {user.firstname},</p>
-            <p>We received a request to reset your password. To proceed, please click the link below:</p>
-            <p><a href="{reset_url}" style="color: #4CAF50; text-decoration: none;">Reset Password</a></p>
-            <p>If you did not request a password reset, please ignore this email or contact support if you have any concerns.</p>
-            <p>Best regards,</p>
-            <p>The TimeChronos Team</p>"""
-
-            email_task = {
-                "source": 'contact@digitalshelfiq.com',
-                "destination": email,
-                "subject" : subject,
-                "body_html" : body_html
-            }
-            aws.send_message(env['sqs_url'], message_body= json.dumps(email_task))
+            email_task = EmailHelper().render('password_reset_request.html', email, "Password Reset Request",
+                                              firstname=user.firstname, token=token)
+            OutboxHelper().add(email_task)
 
             query = Token(user_id = user.id, token = token)
             db_helper.add_record(query)
@@ -171,7 +165,6 @@ class Controller:
     def reset_password_with_token(self, token):
         try:
             db_helper = DbHelper()
-            aws = AwsHelper()
             code = CodeHelper()
             email = code.confirm_reset_token(token)
             if not email:
@@ -189,32 +182,20 @@ class Controller:
 
             hashed_password = self.password_helper.hash_password(new_password)
             user.password = hashed_password
-            db_helper.update_record()
 
-            subject = "Password reset successfully"
-            body_html = f"""
-            <p>Dear {user.firstname},</p>
-            <p>We are pleased to inform you that your password has been successfully reset.</p>
-            <p>If you did not perform this action or suspect any unusual activity, please contact our support team immediately.</p>
-            <p>Best regards,</p>
-            <p>The TimeChronos Team</p>"""
-
-            email_task = {
-                "source": 'contact@digitalshelfiq.com',
-                "destination": email,
-                "subject" : subject,
-                "body_html" : body_html
-            }
-            aws.send_message(env['sqs_url'], message_body= json.dumps(email_task))
+            email_task = EmailHelper().render('password_reset.html', email, "Password reset successfully", firstname=user.firstname)
+            OutboxHelper().add(email_task)
+            db_helper.update_record()
 
             return jsonify({'message': 'Password reset successfully', 'status': 200}), 200
+        except PasswordPoolBusy as e:
+            return jsonify({'message': str(e), 'status': 503}), 503
         except Exception as e:
             return jsonify({'message': str(e), 'status': 500}), 500
 
     def change_password(self):
         try:
             db_helper = DbHelper()
-            aws = AwsHelper()
             auth = AuthorizationHelper()
             token = auth.get_jwt_token()
             if not token:
@@ -239,32 +220,20 @@ class Controller:
             
             hashed_password = self.password_helper.hash_password(new_password)
             user.password = hashed_password
-            db_helper.update_record()
 
-            subject = "Password change confirmation"
-            body_html = f"""
-            <p>Dear {user.firstname},</p>
-            <p>This is to confirm that the password of your account has been successfully changed. Your account is now secured with the new password that you have set.</p>
-            <p>If you did not change your password, please contact us immediately to report any unauthorized access to your account.</p>
-            <p>Thank you for using our service.</p>
-            <p>Best Regards,</p>
-            <p>The TimeChronos Team</p>"""
-
-            email_task = {
-                "source": 'contact@digitalshelfiq.com',
-                "destination": email,
-                "subject" : subject,
-                "body_html" : body_html
-            }
-            aws.send_message(env['sqs_url'], message_body= json.dumps(email_task))
+            email_task = EmailHelper().render('password_changed.html', email, "Password change confirmation", firstname=user.firstname)
+            OutboxHelper().add(email_task)
+            db_helper.update_record()
 
             return jsonify({'message': 'Password changed successfully', 'status': 200})
+        except PasswordPoolBusy as e:
+            return jsonify({'message': str(e), 'status': 503}), 503
         except Exception as e:
             return jsonify({'message': str(e), 'status': 500}), 500
         
     def logout(self):
         try:
-            db_helper = DbHelper()
+            blocklist = TokenBlocklistHelper()
             auth = AuthorizationHelper()
             token = auth.get_jwt_token()
             if not token:
@@ -281,8 +250,7 @@ class Controller:
             if not (token_jti):
                 return jsonify({'message': 'Failed to log out. Token invalidation failed', 'status': 500}), 500
             
-            query = BlacklistToken(jti=token_jti)
-            db_helper.add_record(query)
+            blocklist.revoke(token_jti, token.get('exp'))
 
             return jsonify({'message': 'User logged out successfully', 'status': 200}), 200
                     
@@ -349,7 +317,6 @@ class UserController:
 
     def add_user(self):
         try:
-            aws = AwsHelper()
             password_helper = PasswordHelper()
             data = request.get_json()
             required_fields = ['firstname', 'email', 'role', 'password', 'gender','supervisor_id', 'approver_id']
@@ -371,48 +338,35 @@ class UserController:
             supervisor_id = data['supervisor_id']
             approver_id = data['approver_id']
 
-            hashed_password = password_helper.hash_password(password)
-
             if 'phone' in data:
                 phone = data['phone']
                 if not phone.isdigit():
                     return jsonify({'message': 'Invalid input: Please write correct no.', 'status': 400}), 400
 
-            existing_user = User.query.filter_by(email=email, company_id=company_id, is_archived = False).first()
-            if existing_user:
+            # Duplicate-email check and supervisor/approver names in one round trip
+            related = db.session.query(User.id, User.email, User.firstname).filter(
+                User.company_id == company_id,
+                User.is_archived == False,
+                (User.email == email) | User.id.in_({supervisor_id, approver_id})
+            ).all()
+            if any(row.email == email for row in related):
                 return jsonify({'message': 'User already exists with this email', 'status': 409}), 409 
+
+            names = {str(row.id): row.firstname for row in related}
+            if str(supervisor_id) not in names or str(approver_id) not in names:
+                return jsonify({'message': 'Supervisor or approver not found', 'status': 404}), 404
+
+            hashed_password = password_helper.hash_password(password)
             
             user = User(firstname=firstname, lastname=lastname, role=role, email=email, phone=phone, gender=gender, password=hashed_password, company_id=company_id, supervisor_id=supervisor_id, approver_id=approver_id)
-            self.db_helper.add_record(user) 
 
-            supervisor = User.query.filter_by(id=supervisor_id, company_id=company_id, is_archived = False).first()
-            approver = User.query.filter_by(id=approver_id, company_id=company_id, is_archived=False).first()
-
-            login_url = f"{url}/login"
-
-            subject = "Timechronos Account Credentials"
-            body_html = f"""
-            <p>Dear {user.firstname},</p>
-            <p> I hope this  message finds you well.</p>
-            <p> I am pleased to inform you that an account has been successfully created for you on Timechronos by an administrator. To access your account, please use the following credentials:</p>
-                    <p><strong>Username:</strong> {user.email}</p> 
-                    <p><strong>Password:</strong> {password}</p>
-            <p>You can log in to your account by clicking the button below:</p>
-            <p>
-                <a href="{login_url}" style="text-decoration: none;">
-                    <button type="button" style="background-color: #4CAF50; color: white; padding: 10px 20px; border: none; border-radius: 5px; cursor: pointer;">Login</button>
-                </a>
-            <p>We are excited to have you on board and look forward to seeing you on Timechronos!</p>
-            <p>Best Regards,</p>
-            <p>The TimeChronos Team</p>"""
-            
-            email_task = {
-                "source": 'contact@digitalshelfiq.com',
-                "destination": email,
-                "subject" : subject,
-                "body_html" : body_html
-            }
-            aws.send_message(env['sqs_url'], message_body= json.dumps(email_task))
+            # The outbox row outlives the send, so the email carries a set-password link, never the password
+            email_task = EmailHelper().render('account_credentials.html', email, "Timechronos Account Credentials",
+                                              firstname=user.firstname, email=user.email, token=CodeHelper().generate_reset_token(email))
+            OutboxHelper().add(email_task)
+            CounterHelper().record(company_id, 'employees', total=1, active=1)
+            self.db_helper.add_record(user) 
+            ResponseCacheHelper().invalidate(company_id)
 
             return jsonify({
                 'message': 'User added successfully', 
@@ -424,10 +378,12 @@ class UserController:
                 'email': user.email,
                 'phone': user.phone,
                 'gender': user.gender,
-                'supervisor_name': supervisor.firstname,
-                'approver_name': approver.firstname,
+                'supervisor_name': names[str(supervisor_id)],
+                'approver_name': names[str(approver_id)],
                 'is_active': user.is_active,
                 'status': 201})
+        except PasswordPoolBusy as e:
+            return jsonify({'message': str(e), 'status': 503}), 503
         except Exception as e:
             return jsonify({'message': str(e), 'status': 500}), 500
 
@@ -458,14 +414,18 @@ class UserController:
                 if not phone.isdigit():
                     return jsonify({'message': 'Invalid input: Please write correct no.', 'status': 400}), 400
                 
+            was_active = user.is_active
             if 'is_active' in data:
                 user.is_active = data['is_active']
             
             for key, value in data.items():
-                if key != 'id' and value: 
+                if key not in protected_fields and value:
                     setattr(user, key, value)
 
+            CounterHelper().record_active(company_id, 'employees', was_active, user.is_active)
             self.db_helper.update_record()
+            ResponseCacheHelper().invalidate(company_id)
+            PrincipalHelper().invalidate(user_id)
 
             return jsonify({'message': 'User updated successfully', 'status': 200}), 200
         except Exception as e:
@@ -488,9 +448,12 @@ class UserController:
             if not user:
                 return jsonify({'message': 'User not found or does not belong to this company', 'status': 404}), 404
             
+            CounterHelper().record(company_id, 'employees', total=-1, active=-int(bool(user.is_active)))
             user.is_archived = True
             user.is_active = False
             self.db_helper.update_record()
+            ResponseCacheHelper().invalidate(company_id)
+            PrincipalHelper().invalidate(user_id)
             return jsonify({'message': 'User deleted successfully', 'status': 200})
         except Exception as e:
             return jsonify({'message': str(e)}), 500
@@ -518,6 +481,14 @@ class UserController:
             else:
                 is_active_bool = None
 
+            cache = ResponseCacheHelper()
+            not_modified, etag = cache.conditional('userlist', company_id)
+            if not_modified:
+                return not_modified
+            cached = cache.get('userlist', etag)
+            if cached:
+                return cached
+
             supervisor_alias = db.aliased(User)
             approver_alias = db.aliased(User)
 
@@ -531,7 +502,7 @@ class UserController:
                 User.approver_id,
                 User.is_active,
                 User.gender,
-                User.created_date,
+                User.created_at,
                 supervisor_alias.firstname.label('supervisor_firstname'),
                 supervisor_alias.lastname.label('supervisor_lastname'),
                 approver_alias.firstname.label('approver_firstname'),
@@ -544,18 +515,17 @@ class UserController:
             )
 
             if user_name:
-                full_name = func.concat(User.firstname,' ',User.lastname)
-                query = query.filter(full_name.ilike(f'%{user_name}%'))
+                # Same expression as ix_user_full_name_trgm; func.concat is not immutable and cannot be indexed
+                full_name = User.firstname + ' ' + func.coalesce(User.lastname, '')
+                query = query.filter(full_name.ilike(search_pattern(user_name)))
 
             if is_active_bool is not None:
                 query = query.filter(User.is_active == is_active_bool)
 
-            if sort_order == 'asc':
-                query = query.order_by(User.created_date.asc(), User.created_time.asc())
-            else:
-                query = query.order_by(User.created_date.desc(), User.created_time.desc())
-
-            users = query.all()
+            try:
+                users, next_cursor = PaginationHelper().paginate(query, [User.created_at, User.id], sort_order)
+            except ValueError as e:
+                return jsonify({'message': str(e), 'status': 400}), 400
             if not users:
                 return jsonify({'message': 'No users found for this company', 'status': 404}), 404
 
@@ -576,7 +546,7 @@ class UserController:
                     'approver_name': f'{user.approver_firstname} {user.approver_lastname}' if user.approver_firstname else None
                 })
 
-            return jsonify({'users': result, 'status': 200}), 200
+            return cache.set('userlist', etag, {'users': result, 'next_cursor': next_cursor, 'status': 200}), 200
 
         except Exception as e:
             return jsonify({'message': str(e), 'status': 500}), 500
@@ -599,7 +569,6 @@ class ClientController:
                 return jsonify({'message': 'Token not found', 'status': 401}), 401
             
             company_id = self.token.get('company_id')
-            user_id = self.token.get('user_id')
             name = data['name']
             email = data['email']
             phone = data.get('phone')
@@ -607,8 +576,7 @@ class ClientController:
             if not phone.isdigit():
                     return jsonify({'message': 'Invalid input: Please write correct no.', 'status': 400}), 400
             
-            user = User.query.filter_by(id=user_id, company_id=company_id, role='Admin').first()
-            if not user:
+            if self.token.get('role') != 'Admin':
                 return jsonify({'message': 'User is not an admin', 'status': 404}), 404
 
             existing_client = Client.query.filter_by(email=email, company_id=company_id, is_archived = False).first()
@@ -616,8 +584,10 @@ class ClientController:
                 return jsonify({'message': 'Client already exists', 'status': 409}), 409 
             
             client = Client(name=name, email=email, phone=phone, company_id=company_id)
-            self.db_helper.add_record(client)
+            CounterHelper().record(company_id, 'clients', total=1, active=1)
             self.db_helper.log_insert(client, self.token.get('user_id'))
+            self.db_helper.add_record(client)
+            ResponseCacheHelper().invalidate(company_id)
 
             return jsonify({
                 'message': 'Client added successfully',                 
@@ -636,7 +606,6 @@ class ClientController:
                 return jsonify({'message': 'Token not found', 'status': 401}), 401
             
             company_id = self.token.get('company_id')
-            user_id = self.token.get('user_id')
             
             data = request.get_json()
             if not data or not 'id' in data:
@@ -644,8 +613,7 @@ class ClientController:
 
             client_id = data['id']
 
-            user = User.query.filter_by(id=user_id, company_id=company_id, role='Admin').first()
-            if not user:
+            if self.token.get('role') != 'Admin':
                 return jsonify({'message': 'User is not an admin', 'status': 404}), 404
             
             client = Client.query.filter_by(id=client_id, company_id=company_id, is_archived = False).first()
@@ -660,14 +628,17 @@ class ClientController:
             if 'phone' in data and not data['phone'].isdigit():
                 return jsonify({'message': 'Invalid input: Phone number must be exactly 10 digits', 'status': 400}), 400
             
+            was_active = client.is_active
             if 'is_active' in data:
                 client.is_active = data['is_active']
             
             for key, value in data.items():
-                if key != 'id' and value:
+                if key not in protected_fields and value:
                     setattr(client, key, value)
             #self.db_helper.update_record()(old_client, client, self.token.get('user_id'))           
+            CounterHelper().record_active(company_id, 'clients', was_active, client.is_active)
             self.db_helper.update_record()
+            ResponseCacheHelper().invalidate(company_id)
 
             return jsonify({'message': 'Client updated successfully', 'status': 200})
         except Exception as e:
@@ -679,7 +650,6 @@ class ClientController:
                 return jsonify({'message': 'Token not found', 'status': 401}), 401
             
             company_id = self.token.get('company_id')
-            user_id = self.token.get('user_id')
         
             data = request.get_json()
             if not data or not 'id' in data:
@@ -687,18 +657,25 @@ class ClientController:
 
             client_id = data['id']
 
-            user = User.query.filter_by(id=user_id, company_id=company_id, role='Admin').first()
-            if not user:
+            if self.token.get('role') != 'Admin':
                 return jsonify({'message': 'User is not an admin', 'status': 404}), 404
 
             client = Client.query.filter_by(id=client_id, company_id=company_id, is_archived = False).first()
             if not client:
                 return jsonify({'message': 'Client not found or does not belong to this company', 'status': 404}), 404
             
+            # Projects are only counted while their client is live
+            projects = db.session.query(func.count(), func.count().filter(Project.is_active == True)).filter(
+                Project.client_id == client.id, Project.is_archived == False).one()
+            counters = CounterHelper()
+            counters.record(company_id, 'clients', total=-1, active=-int(bool(client.is_active)))
+            counters.record(company_id, 'projects', total=-projects[0], active=-projects[1])
+
             client.is_archived = True
             client.is_active = False
-            self.db_helper.update_record()
             self.db_helper.log_delete(client, self.token.get('user_id'))
+            self.db_helper.update_record()
+            ResponseCacheHelper().invalidate(company_id)
             return jsonify({'message': 'Client deleted successfully', 'status': 200})
         except Exception as e:
             return jsonify({'message': str(e), 'status': 500}), 500
@@ -723,21 +700,27 @@ class ClientController:
             else:
                 is_active_bool = None
 
+            cache = ResponseCacheHelper()
+            not_modified, etag = cache.conditional('clientlist', company_id)
+            if not_modified:
+                return not_modified
+            cached = cache.get('clientlist', etag)
+            if cached:
+                return cached
+
             query = Client.query.filter_by(company_id=company_id, is_archived=False)
 
             
             if client_name:
-                query = query.filter(Client.name.ilike(f'%{client_name}%'))
+                query = query.filter(Client.name.ilike(search_pattern(client_name)))
 
             if is_active_bool is not None:
                 query = query.filter(Client.is_active == is_active_bool)
 
-            if sort_order == 'asc':
-                query = query.order_by(Client.created_date.asc(), Client.created_time.asc())
-            else:
-                query = query.order_by(Client.created_date.desc(), Client.created_time.desc())
-
-            clients = query.all()
+            try:
+                clients, next_cursor = PaginationHelper().paginate(query, [Client.created_at, Client.id], sort_order)
+            except ValueError as e:
+                return jsonify({'message': str(e), 'status': 400}), 400
             if not clients:
                 return jsonify({'message': 'No client found in this company', 'status': 404}), 404
             
@@ -751,8 +734,9 @@ class ClientController:
                     'is_active': client.is_active
                 })
 
-            return jsonify({
+            return cache.set('clientlist', etag, {
                 'clients': client_list,
+                'next_cursor': next_cursor,
                 'status': 200
             })
         except Exception as e:
@@ -770,7 +754,6 @@ class ProjectController:
             if not self.token:
                 return jsonify({'message': 'Token not found', 'status': 401}), 401
             
-            user_id = self.token.get('user_id')
             company_id = self.token.get('company_id')
 
             data = request.get_json()
@@ -781,11 +764,12 @@ class ProjectController:
             name = data['name']
             client_id = data['client_id']
 
-            user = User.query.filter_by(id=user_id, company_id=company_id, role='Admin').first()
-            if not user:
+            if self.token.get('role') != 'Admin':
                 return jsonify({'message': 'User is not an admin', 'status': 404}), 404
 
             client = Client.query.filter_by(id=client_id, company_id=company_id, is_archived = False).first()
+            if not client:
+                return jsonify({'message': 'Client not found', 'status': 404}), 404
 
             existing_project = Project.query.filter_by(name=name, client_id=client_id, is_archived = False).first()
             if existing_project:
@@ -793,11 +777,13 @@ class ProjectController:
 
             project = Project(is_active=True)
             for key, value in data.items():
-                if hasattr(Project, key): 
+                if hasattr(Project, key) and key not in protected_fields:
                     setattr(project, key, value)
 
-            self.db_helper.add_record(project)
+            CounterHelper().record(company_id, 'projects', total=1, active=int(bool(project.is_active)))
             self.db_helper.log_insert(project, self.token.get('user_id'))
+            self.db_helper.add_record(project)
+            ResponseCacheHelper().invalidate(company_id)
 
             return jsonify({
                 'message': 'Project added successfully', 
@@ -817,7 +803,6 @@ class ProjectController:
             if not self.token:
                 return jsonify({'message': 'Token not found', 'status': 401}), 401
             
-            user_id = self.token.get('user_id')
             company_id = self.token.get('company_id')
 
             data = request.get_json()
@@ -827,32 +812,38 @@ class ProjectController:
 
             client_id = data['client_id']
 
-            user = User.query.filter_by(id=user_id, company_id=company_id, role='Admin').first()
-            if not user:
+            if self.token.get('role') != 'Admin':
                 return jsonify({'message': 'User is not an admin', 'status': 404}), 404
 
             client = Client.query.filter_by(id=client_id, company_id=company_id, is_archived = False).first()
+            if not client:
+                return jsonify({'message': 'Client not found', 'status': 404}), 404
 
             if 'id' in data:
-                project= Project.query.filter_by(id=data['id']).first()
+                project = company_project(data['id'], company_id)
                 if not project:
                     return jsonify({'message': 'Project not found', 'status': 404}), 404
                 
                 else:
+                    before = project_counted(project)
                     for key, value in data.items():
-                        if key != 'id' and value:
+                        if key not in protected_fields and value:
                             setattr(project, key, value)
 
+                    CounterHelper().record_change(company_id, 'projects', before, project_counted(project))
                     self.db_helper.update_record()
+                    ResponseCacheHelper().invalidate(company_id)
                     return jsonify({'message': 'Project updated successfully', 'status': 200}), 200
                 
             project = Project(is_active=True)
             for key, value in data.items():
-                if hasattr(Project, key): 
+                if hasattr(Project, key) and key not in protected_fields:
                     setattr(project, key, value)
 
-            self.db_helper.add_record(project)
+            CounterHelper().record(company_id, 'projects', total=1, active=int(bool(project.is_active)))
             self.db_helper.log_insert(project, self.token.get('user_id'))
+            self.db_helper.add_record(project)
+            ResponseCacheHelper().invalidate(company_id)
 
             return jsonify({
                 'message': 'Project added successfully', 
@@ -869,7 +860,6 @@ class ProjectController:
 
     def update_project(self):
         try:
-            user_id = self.token.get('user_id')
             company_id = self.token.get('company_id')
 
             data = request.get_json()
@@ -878,13 +868,15 @@ class ProjectController:
 
             project_id = data['id']
 
-            user = User.query.filter_by(id=user_id, company_id=company_id, role='Admin').first()
-            if not user:
+            if self.token.get('role') != 'Admin':
                 return jsonify({'message': 'User is not an admin', 'status': 404}), 404
 
-            project = Project.query.filter_by(id=project_id, is_archived = False).first()
+            project = company_project(project_id, company_id)
             if not project:
                 return jsonify({'message': 'Project not found', 'status': 404}), 404
+
+            if data.get('client_id') and not Client.query.filter_by(id=data['client_id'], company_id=company_id, is_archived = False).first():
+                return jsonify({'message': 'Client not found', 'status': 404}), 404
             
             if 'name' in data:
                 new_name = data['name']
@@ -893,21 +885,23 @@ class ProjectController:
                 if existing_project and existing_project.id != project_id:
                     return jsonify({'message': 'A project with the same name already exists.', 'status': 409}), 409
                 
+            before = project_counted(project)
             if 'is_active' in data:
                 project.is_active = data['is_active']
             
             for key, value in data.items():
-                if key != 'id' and value:
+                if key not in protected_fields and value:
                     setattr(project, key, value)
             #self.db_helper.update_record()(project, self.token.get('user_id')) 
+            CounterHelper().record_change(company_id, 'projects', before, project_counted(project))
             self.db_helper.update_record()
+            ResponseCacheHelper().invalidate(company_id)
             return jsonify({'message': 'Project updated successfully', 'status': 200})
         except Exception as e:
             return jsonify({'message': str(e), 'status': 500}), 500
 
     def delete_project(self):
         try:
-            user_id = self.token.get('user_id')
             company_id = self.token.get('company_id')
 
             data = request.get_json()
@@ -916,18 +910,20 @@ class ProjectController:
 
             project_id = data['id']
 
-            user = User.query.filter_by(id=user_id, company_id=company_id, role='Admin').first()
-            if not user:
+            if self.token.get('role') != 'Admin':
                 return jsonify({'message': 'User is not an admin', 'status': 404}), 404
 
-            project = Project.query.filter_by(id=project_id, is_archived = False).first()
+            project = company_project(project_id, company_id)
             if not project:
                 return jsonify({'message': 'Project not found', 'status': 404}), 404
             
+            before = project_counted(project)
             project.is_archived = True
             project.is_active = False
-            self.db_helper.update_record()
+            CounterHelper().record_change(company_id, 'projects', before, project_counted(project))
             self.db_helper.log_delete(project, self.token.get('user_id'))
+            self.db_helper.update_record()
+            ResponseCacheHelper().invalidate(company_id)
             return jsonify({'message': 'Project deleted successfully', 'status': 200})
         except Exception as e:
             return jsonify({'message': str(e), 'status': 500}), 500
@@ -953,12 +949,21 @@ class ProjectController:
             else:
                 is_active_bool = None
 
+            cache = ResponseCacheHelper()
+            not_modified, etag = cache.conditional('projectlist', company_id)
+            if not_modified:
+                return not_modified
+            cached = cache.get('projectlist', etag)
+            if cached:
+                return cached
+
             query = db.session.query(
                 Project.id, 
                 Project.name,
                 Project.start_date, 
                 Project.end_date, 
                 Project.is_active, 
+                Project.created_at,
                 Client.id.label('client_id'), 
                 Client.name.label('client_name'), 
             ).join(Client, Project.client_id == Client.id).filter(
@@ -967,20 +972,18 @@ class ProjectController:
             )
 
             if project_name:
-                query = query.filter(Project.name.ilike(f'%{project_name}%'))
+                query = query.filter(Project.name.ilike(search_pattern(project_name)))
 
             if client_name:
-                query = query.filter(Client.name.ilike(f'%{client_name}%'))
+                query = query.filter(Client.name.ilike(search_pattern(client_name)))
             
             if is_active_bool is not None:
                 query = query.filter(Project.is_active == is_active_bool)
 
-            if sort_order == 'asc':
-                query = query.order_by(Project.created_date.asc(), Project.created_time.asc())
-            else:
-                query = query.order_by(Project.created_date.desc(), Project.created_time.desc())
-
-            projects = query.all()
+            try:
+                projects, next_cursor = PaginationHelper().paginate(query, [Project.created_at, Project.id], sort_order)
+            except ValueError as e:
+                return jsonify({'message': str(e), 'status': 400}), 400
 
             if not projects:
                 return jsonify({'message': 'No projects found for this company', 'status': 404}), 404
@@ -996,8 +999,9 @@ class ProjectController:
                     'client_id': str(project.client_id),
                     'client_name': project.client_name 
                 })
-            return jsonify({
+            return cache.set('projectlist', etag, {
                 'projects': project_list,
+                'next_cursor': next_cursor,
                 'status': 200
             })
         except Exception as e:
@@ -1012,7 +1016,6 @@ class TaskController:
 
     def add_task(self):
         try:
-            user_id = self.token.get('user_id')
             company_id = self.token.get('company_id')
 
             data = request.get_json()
@@ -1022,11 +1025,12 @@ class TaskController:
             name = data['name']
             project_id = data['project_id']
 
-            user = User.query.filter_by(id=user_id, company_id=company_id, role='Admin').first()
-            if not user:
+            if self.token.get('role') != 'Admin':
                 return jsonify({'message': 'User is not an admin', 'status': 404}), 404
 
-            project = Project.query.filter_by(id=project_id, is_archived = False).first()
+            project = company_project(project_id, company_id)
+            if not project:
+                return jsonify({'message': 'Project not found', 'status': 404}), 404
             client = Client.query.filter_by(id=project.client_id).first()
 
             existing_task = Task.query.filter_by(name=name, project_id=project_id, is_archived = False).first()
@@ -1035,11 +1039,13 @@ class TaskController:
             
             task = Task(is_active=True)
             for key, value in data.items():
-                if hasattr(Task, key): 
+                if hasattr(Task, key) and key not in protected_fields:
                     setattr(task, key, value)
             
-            self.db_helper.add_record(task)
+            CounterHelper().record(company_id, 'tasks', total=1, active=int(bool(task.is_active)))
             self.db_helper.log_insert(task, self.token.get('user_id'))
+            self.db_helper.add_record(task)
+            ResponseCacheHelper().invalidate(company_id)
             return jsonify({
                 'message': 'Task added successfully',
                 'id': str(task.id),
@@ -1060,7 +1066,6 @@ class TaskController:
             if not self.token:
                 return jsonify({'message': 'Token not found', 'status': 401}), 401
             
-            user_id = self.token.get('user_id')
             company_id = self.token.get('company_id')
             
             data = request.get_json()
@@ -1069,33 +1074,39 @@ class TaskController:
 
             project_id = data['project_id']
 
-            user = User.query.filter_by(id=user_id, company_id=company_id, role='Admin').first()
-            if not user:
+            if self.token.get('role') != 'Admin':
                 return jsonify({'message': 'User is not an admin', 'status': 404}), 404
 
-            project = Project.query.filter_by(id=project_id, is_archived = False).first()
+            project = company_project(project_id, company_id)
+            if not project:
+                return jsonify({'message': 'Project not found', 'status': 404}), 404
             client = Client.query.filter_by(id=project.client_id).first()
             
             if 'id' in data:
-                task= Task.query.filter_by(id=data['id']).first()
+                task = company_task(data['id'], company_id)
                 if not task:
                     return jsonify({'message': 'Task not found', 'status': 404}), 404
                 
                 else:
+                    before = (not task.is_archived, task.is_active)
                     for key, value in data.items():
-                        if key != 'id' and value:
+                        if key not in protected_fields and value:
                             setattr(task, key, value)
 
+                    CounterHelper().record_change(company_id, 'tasks', before, (not task.is_archived, task.is_active))
                     self.db_helper.update_record()
+                    ResponseCacheHelper().invalidate(company_id)
                     return jsonify({'message': 'Task updated successfully', 'status': 200}), 200
             
             task = Task(is_active=True)
             for key, value in data.items():
-                if hasattr(Task, key): 
+                if hasattr(Task, key) and key not in protected_fields:
                     setattr(task, key, value)
 
-            self.db_helper.add_record(task)
+            CounterHelper().record(company_id, 'tasks', total=1, active=int(bool(task.is_active)))
             self.db_helper.log_insert(task, self.token.get('user_id'))
+            self.db_helper.add_record(task)
+            ResponseCacheHelper().invalidate(company_id)
             return jsonify({
                 'message': 'Task added successfully',
                 'id': str(task.id),
@@ -1114,7 +1125,6 @@ class TaskController:
         
     def update_task(self):
         try:
-            user_id = self.token.get('user_id')
             company_id = self.token.get('company_id')
 
             data = request.get_json()
@@ -1123,13 +1133,15 @@ class TaskController:
 
             task_id = data['id']
 
-            user = User.query.filter_by(id=user_id, company_id=company_id, role='Admin').first()
-            if not user:
+            if self.token.get('role') != 'Admin':
                 return jsonify({'message': 'User is not an admin', 'status': 404}), 404
 
-            task = Task.query.filter_by(id=task_id, is_archived = False).first()
+            task = company_task(task_id, company_id)
             if not task:
                 return jsonify({'message': 'Task not found', 'status': 404}), 404
+
+            if data.get('project_id') and not company_project(data['project_id'], company_id):
+                return jsonify({'message': 'Project not found', 'status': 404}), 404
             
             if 'name' in data:
                 new_name = data['name']
@@ -1138,13 +1150,16 @@ class TaskController:
                 if existing_task and existing_task.id != task_id:
                     return jsonify({'message': 'A task with the same name already exists.', 'status': 409}), 409
         
+            before = (not task.is_archived, task.is_active)
             if 'is_active' in data:
                 task.is_active = data['is_active']
             
             for key, value in data.items():
-                if key != 'id' and value:
+                if key not in protected_fields and value:
                     setattr(task, key, value)
+            CounterHelper().record_change(company_id, 'tasks', before, (not task.is_archived, task.is_active))
             self.db_helper.update_record()
+            ResponseCacheHelper().invalidate(company_id)
             #self.db_helper.update_record()(task, self.token.get('user_id'))
             return jsonify({'message': 'Task updated successfully', 'status': 200})
         except Exception as e:
@@ -1152,7 +1167,6 @@ class TaskController:
 
     def delete_task(self):
         try:
-            user_id = self.token.get('user_id')
             company_id = self.token.get('company_id')
 
             data = request.get_json()
@@ -1161,18 +1175,20 @@ class TaskController:
 
             task_id = data['id']
 
-            user = User.query.filter_by(id=user_id, company_id=company_id, role='Admin').first()
-            if not user:
+            if self.token.get('role') != 'Admin':
                 return jsonify({'message': 'User is not an admin', 'status': 404}), 404
 
-            task = Task.query.filter_by(id=task_id, is_archived = False).first()
+            task = company_task(task_id, company_id)
             if not task:
                 return jsonify({'message': 'Task not found', 'status': 404}), 404
             
+            before = (not task.is_archived, task.is_active)
             task.is_archived = True
             task.is_active = False
-            self.db_helper.update_record()
+            CounterHelper().record_change(company_id, 'tasks', before, (not task.is_archived, task.is_active))
             self.db_helper.log_delete(task, self.token.get('user_id'))
+            self.db_helper.update_record()
+            ResponseCacheHelper().invalidate(company_id)
             return jsonify({'message': 'Task deleted successfully', 'status': 200})
         except Exception as e:
             return jsonify({'message': str(e), 'status': 500}), 500
@@ -1197,6 +1213,14 @@ class TaskController:
                 is_active_bool = is_active.lower() == 'true'
             else:
                 is_active_bool = None
+
+            cache = ResponseCacheHelper()
+            not_modified, etag = cache.conditional('tasklist', company_id)
+            if not_modified:
+                return not_modified
+            cached = cache.get('tasklist', etag)
+            if cached:
+                return cached
             
             query = db.session.query(
                 Task.id,
@@ -1204,6 +1228,7 @@ class TaskController:
                 Task.start_date,
                 Task.end_date,
                 Task.is_active,
+                Task.created_at,
                 Project.id.label('project_id'),
                 Project.name.label('project_name'),
                 Client.id.label('client_id'),
@@ -1214,22 +1239,18 @@ class TaskController:
             )
 
             if task_name:
-                full_name = func.concat(Task.name)
-                query = query.filter(full_name.ilike(f'%{task_name}%'))
+                query = query.filter(Task.name.ilike(search_pattern(task_name)))
 
             if project_name:
-                full_name = func.concat(Project.name)
-                query = query.filter(full_name.ilike(f'%{project_name}%'))
+                query = query.filter(Project.name.ilike(search_pattern(project_name)))
             
             if is_active_bool is not None:
                 query = query.filter(Task.is_active == is_active_bool)
 
-            if sort_order == 'asc':
-                query = query.order_by(Task.created_date.asc(), Task.created_time.asc())
-            else:
-                query = query.order_by(Task.created_date.desc(), Task.created_time.desc())
-
-            tasks = query.all()
+            try:
+                tasks, next_cursor = PaginationHelper().paginate(query, [Task.created_at, Task.id], sort_order)
+            except ValueError as e:
+                return jsonify({'message': str(e), 'status': 400}), 400
             if not tasks:
                 return jsonify({'message': 'No tasks found for this company', 'status': 404}), 404
 
@@ -1247,8 +1268,9 @@ class TaskController:
                     'is_active': task.is_active
                 })
 
-            return jsonify({
+            return cache.set('tasklist', etag, {
                 'tasks': task_list,
+                'next_cursor': next_cursor,
                 'status': 200
             })
         except Exception as e:
@@ -1272,25 +1294,27 @@ class TimesheetController:
                 return jsonify({'message': 'Token not found', 'status': 401}), 401
             
             company_id = self.token.get('company_id')
-            email = self.token.get('email')
             user_id = self.token.get('user_id')
             
-            user = User.query.filter_by(id = user_id, email=email, company_id=company_id, is_archived = False).first()
+            user = PrincipalHelper().current(self.token)
             if not user:
                 return jsonify({'message': 'User not found', 'status': 404}), 404
             
-            date = data['date']
+            try:
+                day = CalendarHelper().lookup(data['date'])
+            except (TypeError, ValueError) as e:
+                return jsonify({'message': f'Invalid date: {e}', 'status': 400}), 400
 
-            dimdate = DimDate.query.filter(DimDate.date_actual == date).first()
-            name = f'Week {dimdate.week_of_year}, {dimdate.year_actual} Timesheet'
+            name = f"Week {day['week_of_year']}, {day['year_actual']} Timesheet"
 
             existing_timesheet = Timesheet.query.filter_by(name=name, user_id=user.id, is_archived = False).first()
             if existing_timesheet:
                 return jsonify({'message': 'Timesheet already exists', 'status': 409}), 409
             
-            timesheet = Timesheet(name=name, start_date=dimdate.first_day_of_week, end_date=dimdate.last_day_of_week, user_id=user.id)
-            self.db_helper.add_record(timesheet)
+            timesheet = Timesheet(name=name, start_date=day['first_day_of_week'], end_date=day['last_day_of_week'], user_id=user.id)
             self.db_helper.log_insert(timesheet, user_id)
+            self.db_helper.add_record(timesheet)
+            ResponseCacheHelper().invalidate(company_id, 'timesheets')
             return jsonify({'message': 'Timesheet added successfully', 'status': 201})
         except Exception as e:
             return jsonify({'message': str(e), 'status': 500}), 500
@@ -1301,10 +1325,8 @@ class TimesheetController:
                 return jsonify({'message': 'Token not found', 'status': 401}), 401
             
             company_id = self.token.get('company_id')
-            email = self.token.get('email')
-            user_id = self.token.get('user_id')
             
-            user = User.query.filter_by(id = user_id, email=email, company_id=company_id, is_archived = False).first()
+            user = PrincipalHelper().current(self.token)
             if not user:
                 return jsonify({'message': 'User not found', 'status': 404}), 404
             
@@ -1323,6 +1345,7 @@ class TimesheetController:
                     if value:
                         setattr(timesheet, key, value)
                 self.db_helper.update_record()
+                ResponseCacheHelper().invalidate(company_id, 'timesheets')
                 #self.db_helper.update_record()(timesheet, user_id)
                 return jsonify({'message': 'Timesheet updated successfully', 'status': 200})
             else:
@@ -1335,11 +1358,9 @@ class TimesheetController:
             if not self.token:
                 return jsonify({'message': 'Token not found', 'status': 401}), 401
             
-            email = self.token.get('email')
             company_id = self.token.get('company_id')
-            user_id = self.token.get('user_id')
         
-            user = User.query.filter_by(id=user_id, email=email, company_id=company_id, is_archived = False).first()
+            user = PrincipalHelper().current(self.token)
             if not user:
                 return jsonify({'message': 'User not found', 'status': 404}), 404
             
@@ -1357,6 +1378,7 @@ class TimesheetController:
                 timesheet.is_archived = True
                 timesheet.is_active = False
                 self.db_helper.update_record()
+                ResponseCacheHelper().invalidate(company_id, 'timesheets')
                 #self.db_helper.update_record()(timesheet, user_id)
                 return jsonify({'message': 'Timesheet deleted successfully', 'status': 200})
             else:
@@ -1367,10 +1389,14 @@ class TimesheetController:
     def timesheet_list(self):
         try:
             user_id = self.token.get('user_id')
-            email = self.token.get('email')
             company_id = self.token.get('company_id')
+
+            cache = ResponseCacheHelper()
+            not_modified, etag = cache.conditional('timesheetlist', company_id, scopes=(None, 'timesheets'), user_id=user_id)
+            if not_modified:
+                return not_modified
            
-            user = User.query.filter_by(id=user_id, email=email, company_id=company_id, is_archived=False).first()
+            user = PrincipalHelper().current(self.token)
             if not user:
                 return jsonify({'message': 'User not found', 'status': 404}), 404
             
@@ -1383,14 +1409,12 @@ class TimesheetController:
 
             filter_value = request.args.get('filter')
             if filter_value:
-                query = query.filter(Timesheet.name.ilike(f'%{filter_value}%'))
-
-            if sort_order == 'asc':
-                query = query.order_by(Timesheet.created_date.asc(), Timesheet.created_time.asc())
-            else:
-                query = query.order_by(Timesheet.created_date.desc(), Timesheet.created_time.desc())
+                query = query.filter(Timesheet.name.ilike(search_pattern(filter_value)))
 
-            timesheets = query.all()
+            try:
+                timesheets, next_cursor = PaginationHelper().paginate(query, [Timesheet.created_at, Timesheet.id], sort_order)
+            except ValueError as e:
+                return jsonify({'message': str(e), 'status': 400}), 400
             if not timesheets:
                 return jsonify({'message': 'No timesheets found for this user', 'status': 404}), 404
             
@@ -1404,10 +1428,11 @@ class TimesheetController:
                     'is_active': timesheet.is_active,
                     'approval': timesheet.approval.value if timesheet.approval else None
                 })
-            return jsonify({
+            return cache.set('timesheetlist', etag, {
                 'timesheets': timesheet_list,
-               'status': 200
-            })
+                'next_cursor': next_cursor,
+                'status': 200
+            }, store=False)
         except Exception as e:          
             return jsonify({'message': str(e), 'status': 500}), 500
 
@@ -1424,26 +1449,41 @@ class TaskHourController:
             data = request.get_json()
 
             # Validate input: it must be a list of dictionaries
-            if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+            if not isinstance(data, list) or not data or not all(isinstance(item, dict) for item in data):
                 return jsonify({'message': 'Invalid input: a list of task hours objects is required', 'status': 400}), 400
 
+            required_fields = ['task_id', 'timesheet_id']
             for entry in data:
-                required_fields = ['task_id', 'timesheet_id']
                 missing_fields = [field for field in required_fields if field not in entry]
-                
                 if missing_fields:
                     return jsonify({'message': f'Missing required fields: {", ".join(missing_fields)}', 'status': 400}), 400
 
-                taskhours_id = entry.get('id')
-                taskhours = TaskHours.query.filter_by(id=taskhours_id).first() if taskhours_id else None
+                values = entry.get('values')
+                if not values or not isinstance(values, list) or len(values) != 7:
+                    return jsonify({'message': 'Values array must be a list with exactly 7 elements', 'status': 400}), 400
+
+            # One lookup each for every referenced taskhours row and timesheet
+            taskhours_ids = [entry['id'] for entry in data if entry.get('id')]
+            if len(taskhours_ids) != len(set(taskhours_ids)):
+                return jsonify({'message': 'Duplicate TaskHours ID in request', 'status': 400}), 400
+            timesheet_ids = {entry['timesheet_id'] for entry in data}
 
-                if taskhours_id and not taskhours:
+            existing = {str(taskhours.id): taskhours for taskhours in TaskHours.query.filter(TaskHours.id.in_(taskhours_ids))} if taskhours_ids else {}
+            # Only the caller's own timesheets; an existing row must stay on the timesheet it is stored under
+            timesheets = {str(timesheet.id): timesheet for timesheet in Timesheet.query.filter(
+                Timesheet.id.in_(timesheet_ids), Timesheet.user_id == self.token.get('user_id'), Timesheet.is_archived == False)}
+
+            old_records = {}
+            rows = []
+            for entry in data:
+                taskhours_id = entry.get('id')
+                if taskhours_id and taskhours_id not in existing:
                     return jsonify({'message': f'TaskHours with ID {taskhours_id} not found', 'status': 404}), 404
 
-                task_id = entry['task_id']
-                timesheet_id = entry['timesheet_id']
+                if taskhours_id and str(existing[taskhours_id].timesheet_id) != str(entry['timesheet_id']):
+                    return jsonify({'message': f'TaskHours with ID {taskhours_id} does not belong to this timesheet', 'status': 400}), 400
 
-                timesheet = Timesheet.query.filter_by(id=timesheet_id, is_archived=False).first()
+                timesheet = timesheets.get(str(entry['timesheet_id']))
                 if not timesheet:
                     return jsonify({'message': 'Timesheet not found or is archived', 'status': 404}), 404
 
@@ -1451,27 +1491,40 @@ class TaskHourController:
                 if timesheet.approval not in [Approval.DRAFT, Approval.REJECTED]:
                     return jsonify({'message': 'Cannot add/update task hours for a timesheet not in draft or rejected state', 'status': 400}), 400
 
-                values = entry.get('values')
-                if not values or not isinstance(values, list) or len(values) != 7:
-                    return jsonify({'message': 'Values array must be a list with exactly 7 elements', 'status': 400}), 400
-
-                comments = entry.get('comments', '')
-
-                if taskhours is None:
-                    taskhours = TaskHours(values=values, comments=comments, task_id=task_id, timesheet_id=timesheet_id)
-                    self.db_helper.add_record(taskhours)
-                    self.db_helper.log_insert(taskhours, self.token.get('user_id'))
+                if taskhours_id:
+                    taskhours = existing[taskhours_id]
+                    old_records[taskhours.id] = self.db_helper.clean_record(taskhours)
+                    rows.append({'id': taskhours.id, 'values': entry['values'], 'task_id': entry['task_id'] or taskhours.task_id, 'timesheet_id': taskhours.timesheet_id})
                 else:
-                    taskhours.values = values
-                    if isinstance(comments, str):
-                        taskhours.comments = comments
-                    taskhours.task_id = task_id or taskhours.task_id  
+                    rows.append({'id': uuid7(), 'values': entry['values'], 'task_id': entry['task_id'], 'timesheet_id': timesheet.id})
+
+            stmt = insert(TaskHours).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[TaskHours.id],
+                set_={
+                    'values': stmt.excluded['values'],
+                    'task_id': stmt.excluded.task_id,
+                    'updated_date': stmt.excluded.updated_date,
+                    'updated_time': stmt.excluded.updated_time
+                }
+            ).returning(TaskHours, sort_by_parameter_order=True)
 
-                    self.db_helper.update_record()
+            saved = db.session.scalars(stmt, execution_options={'populate_existing': True}).all()
+            self.db_helper.log_many(saved, lambda record: 'update' if record.id in old_records else 'insert', old_records, self.token.get('user_id'))
 
-            return jsonify({'message': 'TaskHours saved successfully', 'status': 200 if taskhours_id else 201}), 200 if taskhours_id else 201
+            error = self.db_helper.update_record()
+            if error:
+                return jsonify({'message': error, 'status': 500}), 500
+
+            created = len(old_records) < len(saved)
+            return jsonify({
+                'message': 'TaskHours saved successfully',
+                'ids': [str(taskhours.id) for taskhours in saved],
+                'status': 201 if created else 200
+            }), 201 if created else 200
 
         except Exception as e:
+            db.session.rollback()
             return jsonify({'message': str(e), 'status': 500}), 500
 
         
@@ -1488,85 +1541,103 @@ class TaskHourController:
             if not taskhours:
                 return jsonify({'message': 'TaskHours not found', 'status': 404}), 404
             
-            timesheet = Timesheet.query.filter_by(id=taskhours.timesheet_id, is_archived=False).first()
+            timesheet = Timesheet.query.filter_by(id=taskhours.timesheet_id, user_id=self.token.get('user_id'), is_archived=False).first()
             if not timesheet or timesheet.approval!= Approval.DRAFT:
                 return jsonify({'message': 'Cannot delete taskhours for a timesheet that is not in draft state', 'status': 400}), 400
             
             taskhours.is_active = False
-            self.db_helper.delete_record(taskhours)
             self.db_helper.log_delete(taskhours, self.token.get('user_id'))
+            self.db_helper.delete_record(taskhours)
             return jsonify({'message': 'TaskHours deleted successfully', 'status': 200})
         except Exception as e:
             return jsonify({'message': str(e), 'status': 500}), 500
 
     def taskhours_list(self):
         try:
-            user_id = self.token.get('user_id')
             data = request.get_json()
             if not data or not 'timesheet_id' in data:
                 return jsonify({'message': 'timesheet_id is required', 'status': 400}), 400
             
             timesheet_id = data['timesheet_id']
-            
-            timesheet = Timesheet.query.filter_by(id=timesheet_id, is_archived=False).first()
-            if not timesheet:
-                return jsonify({'message': 'Timesheet not found', 'status': 404}), 404
-
-            user = User.query.filter_by(id=timesheet.user_id, is_archived=False).first()
-            if not user:
-                return jsonify({'message': 'User not found', 'status': 404}), 404
                     
             sort_order = request.args.get('order', 'desc').lower()
 
             if sort_order not in ['asc', 'desc']:
                 return jsonify({'message': 'Invalid sort_order value. Use "asc" or "desc".', 'status': 400}), 400
 
-            query = TaskHours.query.filter_by(timesheet_id=timesheet_id, is_active=True)
+            # Timesheet header, owner and every active row with its task/project/client in one statement
+            query = db.session.query(
+                Timesheet.id.label('timesheet_id'),
+                Timesheet.name.label('timesheet_name'),
+                Timesheet.start_date,
+                Timesheet.end_date,
+                Timesheet.is_active.label('timesheet_is_active'),
+                Timesheet.approval,
+                User.id.label('user_id'),
+                User.firstname,
+                User.lastname,
+                TaskHours.id.label('taskhours_id'),
+                TaskHours.values,
+                TaskHours.is_active,
+                TaskHours.task_id,
+                Task.name.label('task_name'),
+                Project.id.label('project_id'),
+                Project.name.label('project_name'),
+                Client.id.label('client_id'),
+                Client.name.label('client_name')
+            ).outerjoin(User, and_(User.id == Timesheet.user_id, User.is_archived == False)) \
+            .outerjoin(TaskHours, and_(TaskHours.timesheet_id == Timesheet.id, TaskHours.is_active == True)) \
+            .outerjoin(Task, TaskHours.task_id == Task.id) \
+            .outerjoin(Project, Task.project_id == Project.id) \
+            .outerjoin(Client, Project.client_id == Client.id) \
+            .filter(Timesheet.id == timesheet_id, Timesheet.is_archived == False)
 
             if sort_order == 'asc':
-                query = query.order_by(TaskHours.created_date.asc(), TaskHours.created_time.asc())
+                query = query.order_by(TaskHours.created_at.asc(), TaskHours.id.asc())
             else:
-                query = query.order_by(TaskHours.created_date.desc(), TaskHours.created_time.desc())
+                query = query.order_by(TaskHours.created_at.desc(), TaskHours.id.desc())
+
+            rows = query.all()
+            if not rows:
+                return jsonify({'message': 'Timesheet not found', 'status': 404}), 404
 
-            taskhours = query.all()
+            header = rows[0]
+            if not header.user_id:
+                return jsonify({'message': 'User not found', 'status': 404}), 404
             
             taskhour_list = []
-            for taskhour in taskhours:
-                task = Task.query.filter_by(id=taskhour.task_id).first()
-                project = Project.query.filter_by(id=task.project_id).first()
-                client = Client.query.filter_by(id=project.client_id).first()
-
-                if not task or not project or not client:
+            for row in rows:
+                if not row.taskhours_id or not row.client_id:
                     continue 
 
                 taskhour_list.append({
-                    'id': str(taskhour.id),                               
-                    'mon' : taskhour.values[0],
-                    'tue' : taskhour.values[1],
-                    'wed' : taskhour.values[2],
-                    'thu' : taskhour.values[3],
-                    'fri' : taskhour.values[4],
-                    'sat' : taskhour.values[5],
-                    'sun' : taskhour.values[6],
-                    'task_id': str(taskhour.task_id),
-                    'task_name': task.name, 
-                    'client_id': str(client.id),
-                    'client_name': client.name,
-                    'project_id': str(project.id),  
-                    'project_name': project.name,
-                    'is_active': taskhour.is_active
+                    'id': str(row.taskhours_id),                               
+                    'mon' : row.values[0],
+                    'tue' : row.values[1],
+                    'wed' : row.values[2],
+                    'thu' : row.values[3],
+                    'fri' : row.values[4],
+                    'sat' : row.values[5],
+                    'sun' : row.values[6],
+                    'task_id': str(row.task_id),
+                    'task_name': row.task_name, 
+                    'client_id': str(row.client_id),
+                    'client_name': row.client_name,
+                    'project_id': str(row.project_id),  
+                    'project_name': row.project_name,
+                    'is_active': row.is_active
                 })  
                   
             return jsonify({
             'timesheet_details': {
-                'timesheet_id': str(timesheet.id),
-                'timesheet_name': timesheet.name if timesheet else None,
-                'start_date': timesheet.start_date.strftime('%Y-%m-%d'),
-                'end_date': timesheet.end_date.strftime('%Y-%m-%d'),
-                'is_active': timesheet.is_active,
-                'approval': timesheet.approval.value if timesheet.approval else None,
-                'user_id': str(user.id),
-                'user_name': f'{user.firstname} {user.lastname}'
+                'timesheet_id': str(header.timesheet_id),
+                'timesheet_name': header.timesheet_name,
+                'start_date': header.start_date.strftime('%Y-%m-%d'),
+                'end_date': header.end_date.strftime('%Y-%m-%d'),
+                'is_active': header.timesheet_is_active,
+                'approval': header.approval.value if header.approval else None,
+                'user_id': str(header.user_id),
+                'user_name': f'{header.firstname} {header.lastname}'
             },
             'taskhours': taskhour_list,
             'status': 200,
@@ -1583,7 +1654,6 @@ class ApproverController:
 
     def approve_timesheet(self):
         try:
-            aws = AwsHelper()
             data = request.get_json()
             required_fields = ['timesheet_id']
             
@@ -1591,7 +1661,6 @@ class ApproverController:
                 return jsonify({'message': 'Invalid input: timesheet_id required', 'status': 400}), 400
             
             timesheet_id = data['timesheet_id']
-            user_id = self.token.get('user_id')
             company_id = self.token.get('company_id')
 
             timesheet = Timesheet.query.filter_by(id=timesheet_id, is_archived=False).first()
@@ -1602,11 +1671,11 @@ class ApproverController:
             if not user:
                 return jsonify({'message': 'User not found', 'status': 404}), 404
             
-            approver = User.query.filter_by(id=user.approver_id, company_id=company_id, is_archived=False).first()
-            if not approver:
+            approver = PrincipalHelper().current(self.token)
+            if not approver or not user.approver_id:
                 return jsonify({'message': 'No approver found for this user', 'status': 404}), 404
 
-            if str(approver.id) != str(user_id):
+            if str(user.approver_id) != str(approver.id):
                 return jsonify({'message': 'You are not authorized to approve this timesheet', 'status': 403}), 403
                 
             if timesheet.approval == Approval.APPROVED:
@@ -1614,27 +1683,14 @@ class ApproverController:
             
             else:
                 timesheet.approval = Approval.APPROVED
+
+                email_task = EmailHelper().render('timesheet_approved.html', user.email, f'Timesheet Approved for {timesheet.name}',
+                                                  firstname=user.firstname, timesheet=timesheet.name,
+                                                  start_date=timesheet.start_date, end_date=timesheet.end_date)
+                OutboxHelper().add(email_task)
                 self.db_helper.update_record()
+                ResponseCacheHelper().invalidate(company_id, 'timesheets')
                 #self.db_helper.update_record()(timesheet, user_id)
-
-                subject = f'Timesheet Approved for {timesheet.name}'
-                body_html = f'''
-                    <h1>Timesheet Approved</h1>
-                    <p>Dear {user.firstname},</p>
-                    <p>I am  pleased to inform you that your timesheet for "{timesheet.name}" from {timesheet.start_date} to {timesheet.end_date} has been approved and reviewed.</p>
-                    <p><strong>Remarks:</strong> --------------</p>
-                    <p>Thank you for attention to detail and timely submission.</p>
-                    
-                    <p>Best regards,</p>
-                    <p>The TimeChronos Team</p>'''
-
-                email_task = {
-                    "source": 'contact@digitalshelfiq.com',
-                    "destination": user.email,
-                    "subject" : subject,
-                    "body_html" : body_html
-                }
-                aws.send_message(env['sqs_url'], message_body= json.dumps(email_task))
                 return jsonify({'message': 'Timesheet approved successfully', 'status': 201})
         except Exception as e:
             return jsonify({'message': str(e)}), 500
@@ -1642,7 +1698,6 @@ class ApproverController:
 
     def reject_timesheet(self):
         try:
-            aws = AwsHelper()
             data = request.get_json()
             required_fields = ['timesheet_id', 'feedback']
             
@@ -1651,7 +1706,6 @@ class ApproverController:
             
             timesheet_id = data['timesheet_id']
             feedback = data['feedback']
-            user_id = self.token.get('user_id')
             company_id = self.token.get('company_id')
 
             timesheet = Timesheet.query.filter_by(id=timesheet_id, is_archived=False).first()
@@ -1662,11 +1716,11 @@ class ApproverController:
             if not user:
                 return jsonify({'message': 'User not found', 'status': 404}), 404
             
-            approver = User.query.filter_by(id=user.approver_id, company_id=company_id, is_archived=False).first()
-            if not approver:
+            approver = PrincipalHelper().current(self.token)
+            if not approver or not user.approver_id:
                 return jsonify({'message': 'No approver found for this user', 'status': 404}), 404
 
-            if str(approver.id) != str(user_id):
+            if str(user.approver_id) != str(approver.id):
                 return jsonify({'message': 'You are not authorized to reject this timesheet', 'status': 403}), 403
             
             if timesheet.approval == Approval.REJECTED:
@@ -1677,34 +1731,20 @@ class ApproverController:
             
             else:
                 timesheet.approval = Approval.REJECTED
+
+                email_task = EmailHelper().render('timesheet_rejected.html', user.email, f'Timesheet Rejected for {timesheet.name}',
+                                                  firstname=user.firstname, timesheet=timesheet.name, feedback=feedback,
+                                                  start_date=timesheet.start_date, end_date=timesheet.end_date)
+                OutboxHelper().add(email_task)
                 self.db_helper.update_record()
+                ResponseCacheHelper().invalidate(company_id, 'timesheets')
                 #self.db_helper.update_record()(timesheet, user_id)
-
-                subject = f'Timesheet Rejected for {timesheet.name}'
-                body_html = f'''
-                    <h1>Timesheet Rejected</h1>
-                    <p>Dear {user.firstname},</p>
-                    <p>I regret to inform that your timesheet for the "{timesheet.name}" from {timesheet.start_date} to {timesheet.end_date} has been rejected due to following reasons:</p><p><strong>Feedback:</strong> "{feedback}"</p>
-                    <p>Please make the  necessary corrections and resubmit your timesheet for approval.</p>
-                    <p>If you require any clarification or assistance, please don't hesitate to contact us.</p>
-                    <p>Thank you for your attention.</p>
-                    <p>Best regards,</p>
-                    <p>The TimeChronos Team</p>'''
-
-                email_task = {
-                    "source": 'contact@digitalshelfiq.com',
-                    "destination": user.email,
-                    "subject" : subject,
-                    "body_html" : body_html
-                }
-                aws.send_message(env['sqs_url'], message_body= json.dumps(email_task))
                 return jsonify({'message': 'Timesheet rejected successfully', 'status': 201})
         except Exception as e:
             return jsonify({'message': str(e)}), 500
 
     def send_approval_request(self):
         try:
-            aws = AwsHelper()
             data = request.get_json()
             required_fields = ['timesheet_id']
             
@@ -1712,10 +1752,9 @@ class ApproverController:
                 return jsonify({'message': 'Invalid input: timesheet_id required', 'status': 400}), 400
 
             timesheet_id = data['timesheet_id']
-            user_id = self.token.get('user_id')
             company_id = self.token.get('company_id')
 
-            user = User.query.filter_by(id=user_id, company_id=company_id, is_archived=False).first()
+            user = PrincipalHelper().current(self.token)
             if not user:
                 return jsonify({'message': 'User not found', 'status': 404}), 404
 
@@ -1729,26 +1768,12 @@ class ApproverController:
             
             if timesheet.approval == Approval.DRAFT or timesheet.approval == Approval.REJECTED:
                 timesheet.approval = Approval.PENDING
+
+                email_task = EmailHelper().approval_request(approver, user, timesheet)
+                OutboxHelper().add(email_task, digest_key=f'approval:{approver.id}')
                 self.db_helper.update_record()
+                ResponseCacheHelper().invalidate(company_id, 'timesheets')
                 #self.db_helper.update_record()(timesheet, user_id)
-
-                subject = 'Timesheet Approval Request'
-                body_html = f'''
-                    <h1>Timesheet Approval Request</h1>
-                    <p>Dear {approver.firstname},</p>
-                    <p>A new timesheet has been submitted for your approval.</p>
-                    <p>Please review and approve {user.firstname} {user.lastname}'s timesheet for the {timesheet.name} from {timesheet.start_date} to {timesheet.end_date} at your earliest convenience.</p>
-                    <p>Timesheet link: <a href="{url}/approval/{timesheet_id}">Click Here</a></p>
-                    <p>Best regards,</p>
-                    <p> TimeChronos Team </p>'''
-            
-                email_task = {
-                    "source": 'contact@digitalshelfiq.com',
-                    "destination": approver.email,
-                    "subject" : subject,
-                    "body_html" : body_html
-                }
-                aws.send_message(env['sqs_url'], message_body= json.dumps(email_task))
                 return jsonify({'message': 'Approval request sent successfully', 'status': 201})
             
             else:
@@ -1759,7 +1784,6 @@ class ApproverController:
         
     def send_recall_request(self):
         try:
-            aws = AwsHelper()
             data = request.get_json()
             required_fields = ['timesheet_id']
             
@@ -1767,10 +1791,9 @@ class ApproverController:
                 return jsonify({'message': 'Invalid input: timesheet_id required', 'status': 400}), 400
 
             timesheet_id = data['timesheet_id']
-            user_id = self.token.get('user_id')
             company_id = self.token.get('company_id')
 
-            user = User.query.filter_by(id=user_id, company_id=company_id, is_archived=False).first()
+            user = PrincipalHelper().current(self.token)
             if not user:
                 return jsonify({'message': 'User not found', 'status': 404}), 404
             
@@ -1784,30 +1807,15 @@ class ApproverController:
             
             if timesheet.approval == Approval.APPROVED:
                 timesheet.approval = Approval.RECALLED
+
+                email_task = EmailHelper().render('recall_request.html', approver.email, 'Timesheet Recall Request',
+                                                  approver=approver.firstname, firstname=user.firstname,
+                                                  employee=f"{user.firstname} {user.lastname}", timesheet=timesheet.name,
+                                                  start_date=timesheet.start_date, end_date=timesheet.end_date)
+                OutboxHelper().add(email_task)
                 self.db_helper.update_record()
+                ResponseCacheHelper().invalidate(company_id, 'timesheets')
                 #self.db_helper.update_record()(timesheet, user_id)
-
-                subject = 'Timesheet Recall Request'
-                body_html = f'''
-                    <h1>Timesheet Recall Request</h1>
-                    <p>Dear {approver.firstname},</p>
-                    <p>We are writing to inform you that {user.firstname} {user.lastname} has requested to recall their {timesheet.name} from {timesheet.start_date} to {timesheet.end_date}. They have expressed a need to make some changes to their recorded hours.</p>
-                    <p>To accept the recall request and allow {user.firstname} to make necessary adjustments. Please click on button below:</p>
-                    <p>
-                        <a href="{url}/approvals" style="text-decoration: none;">
-                            <button type="button" style="background-color: #4CAF50; color: white; padding: 10px 20px; border: none; border-radius: 5px; cursor: pointer;">Recall Timesheet</button>
-                        </a>
-                    </p>
-                    <p>Best regards,</p>
-                    <p> TimeChronos Team </p>'''
-
-                email_task = {
-                    "source": 'contact@digitalshelfiq.com',
-                    "destination": approver.email,
-                    "subject" : subject,
-                    "body_html" : body_html
-                }
-                aws.send_message(env['sqs_url'], message_body= json.dumps(email_task))
             else:
                 return jsonify({'message': 'Timesheet cannot be accepted as it is not in recalled status', 'status': 400}), 400
             
@@ -1818,7 +1826,6 @@ class ApproverController:
         
     def accept_recall_request(self):
         try:
-            aws = AwsHelper()
             data = request.get_json()
             required_fields = ['timesheet_id']
             
@@ -1826,7 +1833,6 @@ class ApproverController:
                 return jsonify({'message': 'Invalid input: timesheet_id required', 'status': 400}), 400
 
             timesheet_id = data['timesheet_id']
-            user_id = self.token.get('user_id')
             company_id = self.token.get('company_id')
 
             timesheet = Timesheet.query.filter_by(id=timesheet_id, is_archived=False).first()
@@ -1837,35 +1843,22 @@ class ApproverController:
             if not user:
                 return jsonify({'message': 'User not found', 'status': 404}), 404
             
-            approver = User.query.filter_by(id=user.approver_id, company_id=company_id, is_archived=False).first()
-            if not approver:
+            approver = PrincipalHelper().current(self.token)
+            if not approver or not user.approver_id:
                 return jsonify({'message': 'No approver found for this user', 'status': 404}), 404
 
-            if str(approver.id) != str(user_id):
+            if str(user.approver_id) != str(approver.id):
                 return jsonify({'message': 'You are not authorized to accept recall request this timesheet', 'status': 403}), 403
             
             if timesheet.approval == Approval.RECALLED:
                 timesheet.approval = Approval.DRAFT
+            
+                email_task = EmailHelper().render('recall_accepted.html', user.email, 'Timesheet Recall Accepted',
+                                                  firstname=user.firstname, timesheet=timesheet.name, timesheet_id=timesheet_id)
+                OutboxHelper().add(email_task)
                 self.db_helper.update_record()
+                ResponseCacheHelper().invalidate(company_id, 'timesheets')
                 #self.db_helper.update_record()(timesheet, user_id)
-            
-                subject = 'Timesheet Recall Accepted'
-                body_html = f'''
-                    <h1>Timesheet Recall Accepted</h1>
-                    <p>Dear {user.firstname},</p>
-                    <p>Your recall request for the timesheet titled "<strong>{timesheet.name}</strong>" has been accepted.</p>
-                    <p>You can review the timesheet at the following link:</p>
-                    <p><a href="{url}/timesheet/{timesheet_id}" style="color: #4CAF50; text-decoration: none;">Click Here</a></p>
-                    <p>Best regards,</p>
-                    <p>The TimeChronos Team</p>'''
-                
-                email_task = {
-                    "source": 'contact@digitalshelfiq.com',
-                    "destination": user.email,
-                    "subject" : subject,
-                    "body_html" : body_html
-                }
-                aws.send_message(env['sqs_url'], message_body= json.dumps(email_task))
             else:
                 return jsonify({'message': 'Timesheet cannot be accepted as it is not in recalled status', 'status': 400}), 400
             
@@ -1878,31 +1871,74 @@ class ApproverController:
         try:    
             user_id = self.token.get('user_id')
             company_id = self.token.get('company_id')
-            users = User.query.filter_by(approver_id=user_id, company_id=company_id, is_archived=False).all()
-            if not users:
+            status = request.args.get('status', type=str)
+            try:
+                start_date = request.args.get('start_date', type=str)
+                end_date = request.args.get('end_date', type=str)
+                start_date = date.fromisoformat(start_date) if start_date else None
+                end_date = date.fromisoformat(end_date) if end_date else None
+            except ValueError:
+                return jsonify({'message': 'start_date and end_date must be in YYYY-MM-DD format', 'status': 400}), 400
+
+            filters = [Timesheet.approval != Approval.DRAFT]
+            if status:
+                try:
+                    statuses = [Approval(value.strip().upper()) for value in status.split(',')]
+                except ValueError:
+                    return jsonify({'message': 'Invalid status value', 'status': 400}), 400
+                filters.append(Timesheet.approval.in_(statuses))
+            if start_date:
+                filters.append(Timesheet.start_date >= start_date)
+            if end_date:
+                filters.append(Timesheet.end_date <= end_date)
+
+            subordinates = and_(User.approver_id == user_id, User.company_id == company_id, User.is_archived == False)
+
+            counts = db.session.query(
+                func.count(func.distinct(User.id)).label('subordinates'),
+                func.count(Timesheet.id).label('total')
+            ).select_from(User).outerjoin(Timesheet, and_(Timesheet.user_id == User.id, *filters)).filter(subordinates).one()
+
+            if not counts.subordinates:
                 return jsonify({'message': 'User is not approver', 'status': 404}), 404
-                
+
+            if not counts.total:
+                return jsonify({'message': 'No timesheets found for approval', 'timesheets': [], 'status': 404}), 404
+
+            query = db.session.query(
+                Timesheet.id,
+                Timesheet.name,
+                Timesheet.approval,
+                Timesheet.start_date,
+                Timesheet.end_date,
+                User.firstname,
+                User.lastname
+            ).join(User, Timesheet.user_id == User.id).filter(subordinates, *filters)
+
+            try:
+                timesheets, next_cursor = PaginationHelper().paginate(query, [Timesheet.start_date, Timesheet.id])
+            except ValueError as e:
+                return jsonify({'message': str(e), 'status': 400}), 400
             
             timesheet_list = []
-            for approver in users:
-                timesheets = Timesheet.query.filter(Timesheet.user_id == approver.id, Timesheet.approval != Approval.DRAFT).all()
-
-                if not timesheets and not timesheet_list:
-                    return jsonify({'message': 'No timesheets found for approval', 'timesheets': [], 'status': 404}), 404
-            
-                for timesheet in timesheets:
-                    employee = User.query.get(approver.id)
-                    timesheet_data = {
-                        'id': timesheet.id,
-                        'name': timesheet.name,
-                        'status': timesheet.approval.value, 
-                        'start_date': timesheet.start_date.strftime('%Y-%m-%d'),
-                        'end_date': timesheet.end_date.strftime('%Y-%m-%d'),
-                        'employee_name': f"{employee.firstname} {employee.lastname}" if employee.firstname and employee.lastname else employee.firstname
-                    }
-                    timesheet_list.append(timesheet_data)
-            
-            return jsonify({'message': 'Timesheets and approver retrieved successfully', 'timesheets': timesheet_list, 'status': 200})
+            for timesheet in timesheets:
+                timesheet_data = {
+                    'id': str(timesheet.id),
+                    'name': timesheet.name,
+                    'status': timesheet.approval.value, 
+                    'start_date': timesheet.start_date.strftime('%Y-%m-%d'),
+                    'end_date': timesheet.end_date.strftime('%Y-%m-%d'),
+                    'employee_name': f"{timesheet.firstname} {timesheet.lastname}" if timesheet.firstname and timesheet.lastname else timesheet.firstname
+                }
+                timesheet_list.append(timesheet_data)
+            
+            return jsonify({
+                'message': 'Timesheets and approver retrieved successfully',
+                'timesheets': timesheet_list,
+                'total': counts.total,
+                'next_cursor': next_cursor,
+                'status': 200
+            })
             
         except Exception as e:
             return jsonify({'message': str(e), 'status': 500}), 500
@@ -1930,6 +1966,8 @@ class ProfileController:
                 setattr(user, field, data[field])
         
         self.db_helper.update_record()
+        ResponseCacheHelper().invalidate(company_id)
+        PrincipalHelper().invalidate(user_id)
         return jsonify({'message': 'Profile updated successfully', 'status': 200})
         
     def get_profile(self):
@@ -2015,42 +2053,259 @@ class Statastics:
         user_id = self.token.get('user_id')
         company_id = self.token.get('company_id')
 
-        company = Company.query.get(company_id)
-        if not company:
-            return jsonify({'message': 'Company not found', 'status': 404}), 404
-
-        user = User.query.filter_by(id=user_id, company_id=company_id, is_archived=False).first()
-        if not user:
+        cache = ResponseCacheHelper()
+        not_modified, etag = cache.conditional('getstats', company_id, scopes=(None, 'timesheets'), user_id=user_id)
+        if not_modified:
+            return not_modified
+
+        own_timesheets = db.session.query(
+            func.count().filter(Timesheet.is_archived == False).label('total_timesheet'),
+            func.count().filter(Timesheet.is_archived == False, Timesheet.approval == Approval.PENDING).label('total_pending_approvals')
+        ).filter(Timesheet.user_id == user_id).subquery()
+
+        subordinate = db.aliased(User)
+        approver_timesheets = db.session.query(
+            func.count().filter(Timesheet.approval != Approval.DRAFT).label('total_approver_timesheets'),
+            func.count().filter(Timesheet.is_archived == False, Timesheet.approval == Approval.PENDING).label('total_approver_pending_approvals')
+        ).select_from(Timesheet).join(subordinate, Timesheet.user_id == subordinate.id).filter(subordinate.approver_id == user_id).subquery()
+
+        counter_columns = [getattr(CompanyCounter, name) for name in CompanyCounter.counters]
+
+        stats = db.session.query(
+            User.role,
+            CompanyCounter.company_id.label('counter_company_id'),
+            *counter_columns,
+            *own_timesheets.c,
+            *approver_timesheets.c
+        ).select_from(User) \
+        .join(own_timesheets, true()) \
+        .join(approver_timesheets, true()) \
+        .outerjoin(CompanyCounter, CompanyCounter.company_id == User.company_id) \
+        .filter(User.id == user_id, User.company_id == company_id, User.is_archived == False).first()
+
+        if not stats:
             return jsonify({'message': 'User not found', 'status': 404}), 404
-        
-        approvers = User.query.filter_by(approver_id=user.id).all()
-        
-        if user.role == 'Admin':
-            stats_data = {
-                'total_employees': User.query.filter_by(company_id=company_id, is_archived=False).count(),
-                'active_employees': User.query.filter_by(company_id=company_id, is_archived=False, is_active=True).count(),
-                'total_clients': Client.query.filter_by(company_id=company_id, is_archived=False).count(),
-                'active_clients': Client.query.filter_by(company_id=company_id, is_archived=False, is_active=True).count(),
-                'total_projects': Project.query.join(Client, Project.client_id == Client.id).filter(Client.company_id == company_id, 
-                                                            Client.is_archived == False, Project.is_archived == False).count(),
-                'active_projects': Project.query.join(Client, Project.client_id == Client.id).filter(Client.company_id == company_id, 
-                                                            Client.is_archived == False, Project.is_archived == False, Project.is_active == True).count(),
-                'total_tasks': Task.query.join(Project, Task.project_id == Project.id).join(Client, Project.client_id == Client.id).filter(
-                                                            Client.company_id == company_id, Task.is_archived == False).count(),
-                'active_tasks': Task.query.join(Project, Task.project_id == Project.id).join(Client, Project.client_id == Client.id).filter(
-                                                            Client.company_id == company_id, Task.is_archived == False, Task.is_active == True).count(),
-                'total_timesheet': Timesheet.query.filter_by(user_id = user.id , is_archived = False).count(),
-                'total_pending_approvals': Timesheet.query.filter_by(user_id = user_id, approval = Approval.PENDING,  is_archived = False).count(),
-                'total_approver_timesheets': sum(Timesheet.query.filter(Timesheet.user_id == approver.id, Timesheet.approval != Approval.DRAFT).count()for approver in approvers),
-                'total_approver_pending_approvals' : sum(Timesheet.query.filter(Timesheet.user_id == approver.id, Timesheet.approval == Approval.PENDING, Timesheet.is_archived == False).count ()for approver in approvers)
-            }
-        else:
-            stats_data = {
-                'total_timesheet': Timesheet.query.filter_by(user_id = user.id , is_archived = False).count(),
-                'total_pending_approvals': Timesheet.query.filter_by(user_id = user_id, approval = Approval.PENDING,  is_archived = False).count(),
-                'total_approver_timesheets': sum(Timesheet.query.filter(Timesheet.user_id == approver.id, Timesheet.approval != Approval.DRAFT).count()for approver in approvers),
-                'total_approver_pending_approvals' : sum(Timesheet.query.filter(Timesheet.user_id == approver.id, Timesheet.approval == Approval.PENDING, Timesheet.is_archived == False).count ()for approver in approvers)
-            }
+
+        stats_data = {}
+        if stats.role == 'Admin':
+            if stats.counter_company_id:
+                stats_data.update({name: getattr(stats, name) for name in CompanyCounter.counters})
+            else:
+                # No counter row yet: answer from a read-only count and leave the write to a worker
+                stats_data.update(CounterHelper().count(company_id))
+                try:
+                    rebuild_company_counter.delay(str(company_id))
+                except Exception as e:
+                    print(f"An error occurred: {e}")
+
+        stats_data.update({
+            'total_timesheet': stats.total_timesheet,
+            'total_pending_approvals': stats.total_pending_approvals,
+            'total_approver_timesheets': stats.total_approver_timesheets,
+            'total_approver_pending_approvals': stats.total_approver_pending_approvals
+        })
                 
-        return jsonify({'stats_data': stats_data, 'status': 200}), 200
+        return cache.set('getstats', etag, {'stats_data': stats_data, 'status': 200}, store=False), 200
+
+class MetadataController:
+    # Everything the SPA loads after login, read in one statement. Postgres builds the whole
+    # JSON document, so rows are serialized once and go straight into the response body.
+    # With ?since=<watermark> only rows changed after it are returned (archived ones included,
+    # flagged by is_archived); the response carries the watermark for the next call.
+    watermark_overlap = timedelta(seconds=30)
+
+    def __init__(self):
+        self.auth = AuthorizationHelper()
+        self.token = self.auth.get_jwt_token()
+
+    def aggregate(self, fields, *order_by):
+        document = func.json_build_object(*[part for field in fields for part in field])
+        return func.coalesce(func.json_agg(aggregate_order_by(document, *order_by)), cast(literal('[]'), JSON))
 
+    def visible(self, since, model, *related):
+        # A row is resent when it or a row whose name it embeds changed after the watermark
+        if since is None:
+            return model.is_archived == False
+        return or_(*[tuple_(table.updated_date, table.updated_time) >= (since.date(), since.time()) for table in (model,) + related])
+
+    def metadata(self):
+        try:
+            if not self.token:
+                return jsonify({'message': 'Token not found', 'status': 401}), 401
+
+            user_id = self.token.get('user_id')
+            company_id = self.token.get('company_id')
+
+            since = request.args.get('since')
+            if since:
+                try:
+                    since = datetime.fromisoformat(since)
+                except ValueError:
+                    return jsonify({'message': 'Invalid since value. Use an ISO 8601 timestamp.', 'status': 400}), 400
+            else:
+                since = None
+
+            cache = ResponseCacheHelper()
+            not_modified, etag = cache.conditional('metadata', company_id, scopes=(None, 'timesheets'), user_id=user_id)
+            if not_modified:
+                return not_modified
+
+            watermark = datetime.now() - self.watermark_overlap
+
+            clients = select(self.aggregate([
+                ('id', Client.id), ('name', Client.name), ('email', Client.email), ('phone', Client.phone),
+                ('is_active', Client.is_active), ('is_archived', Client.is_archived)
+            ], Client.created_at.desc(), Client.id.desc())).where(
+                Client.company_id == company_id, self.visible(since, Client)
+            ).scalar_subquery()
+
+            projects = select(self.aggregate([
+                ('id', Project.id), ('name', Project.name), ('start_date', Project.start_date), ('end_date', Project.end_date),
+                ('is_active', Project.is_active), ('is_archived', Project.is_archived),
+                ('client_id', Client.id), ('client_name', Client.name)
+            ], Project.created_at.desc(), Project.id.desc())).select_from(Project).join(
+                Client, Project.client_id == Client.id
+            ).where(Client.company_id == company_id, self.visible(since, Project, Client)).scalar_subquery()
+
+            tasks = select(self.aggregate([
+                ('id', Task.id), ('name', Task.name), ('start_date', Task.start_date), ('end_date', Task.end_date),
+                ('is_active', Task.is_active), ('is_archived', Task.is_archived),
+                ('project_id', Project.id), ('project_name', Project.name), ('client_id', Client.id), ('client_name', Client.name)
+            ], Task.created_at.desc(), Task.id.desc())).select_from(Task).join(
+                Project, Task.project_id == Project.id
+            ).join(Client, Project.client_id == Client.id).where(
+                Client.company_id == company_id, self.visible(since, Task, Project, Client)
+            ).scalar_subquery()
+
+            timesheets = select(self.aggregate([
+                ('id', Timesheet.id), ('name', Timesheet.name), ('start_date', Timesheet.start_date), ('end_date', Timesheet.end_date),
+                ('is_active', Timesheet.is_active), ('is_archived', Timesheet.is_archived), ('approval', Timesheet.approval)
+            ], Timesheet.created_at.desc(), Timesheet.id.desc())).where(
+                Timesheet.user_id == user_id, self.visible(since, Timesheet)
+            ).scalar_subquery()
+
+            document = func.json_build_object(
+                'message', func.json_build_object('clients', clients, 'projects', projects, 'tasks', tasks, 'timesheets', timesheets),
+                'watermark', watermark.isoformat(),
+                'status', 200
+            )
+            body = db.session.execute(select(cast(document, Text))).scalar()
+
+            response = current_app.response_class(body, mimetype='application/json')
+            if etag:
+                # Weak: the watermark differs between otherwise identical documents
+                response.set_etag(etag, weak=True)
+            return response, 200
+        except Exception as e:
+            return jsonify({'message': str(e), 'status': 500}), 500
+
+class ExportController:
+    # /export/taskhours?start_date=&end_date=[&format=ndjson|csv][&approval=][&async=true]
+    # Streams the company's task hours straight from a server-side cursor; with async=true the
+    # file is written to S3 by a celery worker and the response carries its key and a download
+    # URL that starts working once the upload lands. If the export fails, the error text is
+    # written to error_key instead, and error_url starts working.
+
+    def __init__(self):
+        self.auth = AuthorizationHelper()
+        self.token = self.auth.get_jwt_token()
+
+    def export_taskhours(self):
+        try:
+            if not self.token:
+                return jsonify({'message': 'Token not found', 'status': 401}), 401
+
+            if self.token.get('role') != 'Admin':
+                return jsonify({'message': 'User is not an admin', 'status': 404}), 404
+
+            company_id = self.token.get('company_id')
+            export = ExportHelper()
+
+            try:
+                start_date = datetime.strptime(request.args['start_date'], '%Y-%m-%d').date()
+                end_date = datetime.strptime(request.args['end_date'], '%Y-%m-%d').date()
+            except (KeyError, ValueError):
+                return jsonify({'message': 'start_date and end_date are required in YYYY-MM-DD format', 'status': 400}), 400
+
+            if start_date > end_date:
+                return jsonify({'message': 'start_date must be on or before end_date', 'status': 400}), 400
+
+            fmt = request.args.get('format', 'ndjson').lower()
+            if fmt not in export.formats:
+                return jsonify({'message': 'Invalid format value. Use "ndjson" or "csv".', 'status': 400}), 400
+
+            approval = request.args.get('approval')
+            if approval:
+                try:
+                    approval = Approval(approval.upper())
+                except ValueError:
+                    return jsonify({'message': 'Invalid approval value', 'status': 400}), 400
+
+            if request.args.get('async', 'false').lower() == 'true':
+                key = export.key(company_id, fmt)
+                error_key = export.error_key(key)
+                export_taskhours.delay(str(company_id), start_date.isoformat(), end_date.isoformat(), fmt, key,
+                                       approval.value if approval else None)
+                s3 = S3Helper()
+                return jsonify({
+                    'message': 'Export started',
+                    'key': key,
+                    'url': s3.generate_presigned_of_img(env['bucket_name'], key),
+                    'error_key': error_key,
+                    'error_url': s3.generate_presigned_of_img(env['bucket_name'], error_key),
+                    'status': 202
+                }), 202
+
+            filename = f'taskhours-{start_date.isoformat()}-{end_date.isoformat()}.{fmt}'
+            rows = export.rows(company_id, start_date, end_date, approval)
+            return current_app.response_class(
+                stream_with_context(export.encode(rows, fmt)),
+                mimetype=export.formats[fmt],
+                headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+            )
+        except Exception as e:
+            return jsonify({'message': str(e), 'status': 500}), 500
+
+class ImportController:
+    # POST /import/<users|clients|projects|tasks> with a CSV under "file". The first line names
+    # the columns (see ImportHelper.kinds); the whole file is imported or, on any invalid row,
+    # nothing is and the offending lines are returned.
+
+    def __init__(self):
+        self.auth = AuthorizationHelper()
+        self.token = self.auth.get_jwt_token()
+
+    def import_rows(self, kind):
+        try:
+            if not self.token:
+                return jsonify({'message': 'Token not found', 'status': 401}), 401
+
+            if self.token.get('role') != 'Admin':
+                return jsonify({'message': 'User is not an admin', 'status': 404}), 404
+
+            if kind not in ImportHelper.kinds:
+                return jsonify({'message': f'Invalid import type. Use one of: {", ".join(ImportHelper.kinds)}', 'status': 400}), 400
+
+            if 'file' not in request.files:
+                return jsonify({'message': 'No file provided', 'status': 400}), 400
+
+            file = request.files['file']
+            if not file.filename.lower().endswith('.csv'):
+                return jsonify({'message': 'Invalid file type. Only .csv is allowed.', 'status': 400}), 400
+
+            company_id = self.token.get('company_id')
+            try:
+                summary, errors = ImportHelper().run(kind, company_id, self.token.get('user_id'), file.stream)
+            except ValueError as e:
+                db.session.rollback()
+                return jsonify({'message': str(e), 'status': 400}), 400
+
+            if errors:
+                return jsonify({'message': 'Import rejected: no rows were imported', 'errors': errors, 'status': 400}), 400
+
+            if summary['imported']:
+                ResponseCacheHelper().invalidate(company_id)
+            return jsonify(dict(summary, message=f'{kind.capitalize()} imported successfully', status=201)), 201
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'message': str(e), 'status': 500}), 500
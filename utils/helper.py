@@ -1,21 +1,35 @@
-from flask import jsonify, Blueprint
-from utils.models import db, HistoryLogger, TimeStamp
-import bcrypt, boto3, os, json
+from flask import jsonify, Blueprint, request, g, has_request_context, current_app
+from utils.models import db, HistoryLogger, TimeStamp, BlacklistToken, CompanyCounter, User, Client, Project, Task, OutboxMessage, Timesheet, TaskHours, Approval, uuid7
+import bcrypt, boto3, os, json, redis, hashlib, threading, time, base64, uuid, csv, io, tempfile, psycopg2
+from psycopg2.extras import execute_values
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from botocore.config import Config
 from flask_jwt_extended import JWTManager, create_access_token, get_jwt_identity, create_refresh_token, jwt_required, get_jwt
 from itsdangerous import URLSafeTimedSerializer
 from celery_config import celery
 from sqlalchemy.inspection import inspect
 from sqlalchemy.sql import text
+from sqlalchemy import func, select, update, tuple_, event
+from sqlalchemy.dialects.postgresql import insert
 from celery_config import env
+from datetime import datetime, date, timedelta
+from calendar import monthrange
+from array import array
+from jinja2 import Environment, FileSystemLoader
 
 jwt = JWTManager()
 auth = Blueprint('auth', __name__)
+redis_client = redis.Redis.from_url(env['redis'], socket_timeout=1, socket_connect_timeout=1)
 
 class DbHelper:   
+    # Each mutating endpoint is one unit of work: stage everything on db.session, log_* calls
+    # included, and finish with exactly one add_record/update_record commit. expire_on_commit is off, so records
+    # can be serialized after the commit without being reloaded.
 
-    def add_record(self, query):
+    def add_record(self, *records):
         try:
-            db.session.add(query)
+            db.session.add_all(records)
             db.session.commit()
         except Exception as e:
             db.session.rollback()
@@ -49,53 +63,321 @@ class DbHelper:
             if isinstance(getattr(record, column.key), (str, int, float, bool, type(None), dict, list))
         }
 
+    def diff_record(self, record, old_record=None):
+        # Column-level diff: a snapshot (instance or dict) if given, else the unflushed attribute history
+        new = self.clean_record(record)
+        if old_record is not None:
+            old = old_record if isinstance(old_record, dict) else self.clean_record(old_record)
+        else:
+            state = inspect(record)
+            old = {}
+            for column in state.mapper.column_attrs:
+                history = state.attrs[column.key].history
+                if history.has_changes() and column.key in new:
+                    old[column.key] = history.deleted[0] if history.deleted else None
+
+        changed = [key for key in new if key in old and old[key] != new[key]]
+        return {key: old[key] for key in changed}, {key: new[key] for key in changed}
+
+    def history_event(self, record, operation, old_data=None, new_data=None, user_id=None):
+        return {
+            'table_name': record.__tablename__,
+            'record_id': str(record.id),
+            'operation': operation,
+            'old_data': json.dumps(old_data) if old_data else None,
+            'new_data': json.dumps(new_data) if new_data else None,
+            'user_id': str(user_id) if user_id else None
+        }
+
+    def history_rows(self, events):
+        return [dict(event,
+                     record_id=uuid.UUID(event['record_id']),
+                     user_id=uuid.UUID(event['user_id']) if event['user_id'] else None) for event in events]
+
     def log_history(self, table, record, operation, old_record=None, user_id=None):
         old_data = None
         new_data = None
 
-        if operation == 'update':
-            old_data = self.clean_record(old_record) 
+        if operation == 'insert':
+            # Serialized when the transaction commits, once the flush has filled in the id and defaults
+            self.queue_history(lambda: self.history_event(record, operation, None, self.clean_record(record), user_id))
+            return
 
-        if operation in ['insert', 'update']:
-            new_data = self.clean_record(record)
-            if operation == 'insert':
-                db.session.flush()
+        if operation == 'update':
+            old_data, new_data = self.diff_record(record, old_record)
+            if not new_data:
+                return
 
         if operation == 'delete':
             old_data = self.clean_record(record)
 
-        history_entry = HistoryLogger(
-            table_name=table.__tablename__,
-            record_id=str(record.id),
-            operation=operation,
-            old_data=json.dumps(old_data) if old_data else None,
-            new_data=json.dumps(new_data) if new_data else None,
-            user_id=user_id
-        )
+        self.queue_history(self.history_event(record, operation, old_data, new_data, user_id))
+
+    def queue_history(self, event):
+        # Events are buffered for the request and written by stage_history in one insert inside
+        # the transaction that commits the change, so a rolled-back write leaves no history behind
+        if has_request_context():
+            g.setdefault('history_events', []).append(event)
+        else:
+            if callable(event):
+                db.session.flush()
+                event = event()
+            self.write_history([event])
+
+    def resolve_history(self, events):
+        return [event() if callable(event) else event for event in events]
+
+    def flush_history(self, error=None):
+        # Teardown safety net: only events that belong to committed work are left here (queued
+        # after the last commit, or not accepted by celery); a failed request discards them
+        events = g.pop('history_events', None) if has_request_context() else None
+        if not events or error is not None:
+            return
+        return self.write_history(self.resolve_history(events))
 
-        self.add_record(history_entry)
+    def write_history(self, events):
+        try:
+            db.session.execute(insert(HistoryLogger), self.history_rows(events))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            return str(e)
+
+    def log_many(self, records, operation, old_records=None, user_id=None):
+        # One multi-row insert into history_logger; committed together with the caller's changes
+        old_records = old_records or {}
+        events = []
+        for record in records:
+            if record.id in old_records:
+                old_data, new_data = self.diff_record(record, old_records[record.id])
+            else:
+                old_data, new_data = None, self.clean_record(record)
+            events.append(self.history_event(record, operation(record) if callable(operation) else operation,
+                                             old_data, new_data, user_id))
+        if events:
+            db.session.execute(insert(HistoryLogger), self.history_rows(events))
 
     def log_insert(self, record, user_id=None):
-        self.log_history(record.__class__, record, 'insert', user_id)
+        self.log_history(record.__class__, record, 'insert', user_id=user_id)
 
     def log_update(self, record, old_record=None, user_id=None):
         self.log_history(record.__class__, record, 'update', old_record=old_record, user_id=user_id)
 
     def log_delete(self, record, user_id=None):
-        self.log_history(record.__class__, record, 'delete', user_id)
+        self.log_history(record.__class__, record, 'delete', user_id=user_id)
+
+@event.listens_for(db.session, 'before_commit')
+def stage_history(session):
+    if not has_request_context() or not g.get('history_events'):
+        return
+    session.flush()
+    events = DbHelper().resolve_history(g.pop('history_events'))
+    if env['audit-mode'] == 'celery':
+        g.history_published = events
+    else:
+        session.execute(insert(HistoryLogger), DbHelper().history_rows(events))
+
+@event.listens_for(db.session, 'after_commit')
+def publish_history(session):
+    events = g.pop('history_published', None) if has_request_context() else None
+    if not events:
+        return
+    try:
+        record_history.delay(events)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        g.setdefault('history_events', []).extend(events)
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_history(session, previous_transaction):
+    if has_request_context():
+        g.pop('history_events', None)
+        g.pop('history_published', None)
+
+def _hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+def _check_password(password, hashed_password):
+    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+class PasswordPoolBusy(Exception):
+    pass
+
+@celery.task(name='record_history')
+def record_history(events):
+    return DbHelper().write_history(events)
+
+class CounterHelper:
+    # Keeps company_counter in step with the controllers' writes. Deltas are issued on the
+    # caller's session, so they commit or roll back together with the change they count.
+
+    def bump(self, company_id, **deltas):
+        values = {key: getattr(CompanyCounter, key) + delta for key, delta in deltas.items() if delta}
+        if values:
+            db.session.execute(update(CompanyCounter).where(CompanyCounter.company_id == company_id).values(values))
+
+    def record(self, company_id, kind, total=0, active=0):
+        self.bump(company_id, **{f'total_{kind}': total, f'active_{kind}': active})
+
+    def record_active(self, company_id, kind, was_active, is_active):
+        self.record(company_id, kind, active=int(bool(is_active)) - int(bool(was_active)))
+
+    def record_change(self, company_id, kind, before, after):
+        # before/after are (counted, is_active); a row is only counted while it (and, for a
+        # project, its client) is not archived, so the deltas follow that state, not the request
+        (was_counted, was_active), (is_counted, is_active) = before, after
+        self.record(company_id, kind, total=int(bool(is_counted)) - int(bool(was_counted)),
+                    active=int(bool(is_counted and is_active)) - int(bool(was_counted and was_active)))
+
+    def count(self, company_id):
+        users = db.session.query(func.count().label('total'), func.count().filter(User.is_active == True).label('active')).filter(
+            User.company_id == company_id, User.is_archived == False).subquery()
+        clients = db.session.query(func.count().label('total'), func.count().filter(Client.is_active == True).label('active')).filter(
+            Client.company_id == company_id, Client.is_archived == False).subquery()
+        projects = db.session.query(func.count().label('total'), func.count().filter(Project.is_active == True).label('active')).select_from(Project).join(
+            Client, Project.client_id == Client.id).filter(
+            Client.company_id == company_id, Client.is_archived == False, Project.is_archived == False).subquery()
+        tasks = db.session.query(func.count().label('total'), func.count().filter(Task.is_active == True).label('active')).select_from(Task).join(
+            Project, Task.project_id == Project.id).join(Client, Project.client_id == Client.id).filter(
+            Client.company_id == company_id, Task.is_archived == False).subquery()
+
+        row = db.session.execute(select(*users.c, *clients.c, *projects.c, *tasks.c)).one()
+        return dict(zip(CompanyCounter.counters, row))
+
+    def rebuild(self, company_id):
+        values = self.count(company_id)
+        db.session.execute(insert(CompanyCounter).values(company_id=company_id, **values).on_conflict_do_update(
+            index_elements=[CompanyCounter.company_id], set_=values))
+        db.session.commit()
+        return values
+
+@celery.task(name='rebuild_company_counter')
+def rebuild_company_counter(company_id):
+    try:
+        return CounterHelper().rebuild(company_id)
+    except Exception as e:
+        db.session.rollback()
+        print(f"An error occurred: {e}")
+
+class PaginationHelper:
+    # Keyset pagination: rows are ordered by a unique key and the next page starts strictly
+    # after the last key returned, carried by the client as an opaque cursor.
+
+    def __init__(self, default_limit=50, max_limit=200):
+        self.default_limit = default_limit
+        self.max_limit = max_limit
+
+    def get_limit(self):
+        limit = request.args.get('limit', self.default_limit, type=int)
+        return max(1, min(limit, self.max_limit))
+
+    def encode_cursor(self, values):
+        return base64.urlsafe_b64encode(json.dumps(values, default=str).encode('utf-8')).decode('utf-8')
+
+    def decode_cursor(self, cursor):
+        try:
+            return json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+        except (ValueError, TypeError):
+            raise ValueError('Invalid cursor')
+
+    def paginate(self, query, keys, sort_order='desc'):
+        limit = self.get_limit()
+        cursor = request.args.get('cursor')
+
+        if cursor:
+            values = self.decode_cursor(cursor)
+            if not isinstance(values, list) or len(values) != len(keys):
+                raise ValueError('Invalid cursor')
+            if sort_order == 'asc':
+                query = query.filter(tuple_(*keys) > tuple_(*values))
+            else:
+                query = query.filter(tuple_(*keys) < tuple_(*values))
+
+        if sort_order == 'asc':
+            query = query.order_by(*[key.asc() for key in keys])
+        else:
+            query = query.order_by(*[key.desc() for key in keys])
+
+        rows = query.limit(limit + 1).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self.encode_cursor([getattr(rows[-1], key.key) for key in keys])
+        return rows, next_cursor
+
+def search_pattern(value):
+    # Substring pattern for ILIKE with the user's wildcards escaped; served by the pg_trgm indexes
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
 
 class PasswordHelper:
-    def hash_password(self, password):
+    # bcrypt runs on a per-worker process pool; at most password-pool-queue calls may be
+    # queued or running, anything beyond that is refused so the caller can answer 503.
+    # Calls that time out, or hit a pool whose child died, are refused the same way; a broken
+    # pool is dropped so the next call starts a fresh one.
+    _executor = None
+    _lock = threading.Lock()
+    _slots = threading.BoundedSemaphore(env['password-pool-queue'])
+
+    def _pool(self):
+        cls = PasswordHelper
+        if cls._executor is None:
+            with cls._lock:
+                if cls._executor is None:
+                    cls._executor = ProcessPoolExecutor(max_workers=env['password-pool-workers'])
+        return cls._executor
+
+    def _discard(self, executor):
+        cls = PasswordHelper
+        with cls._lock:
+            if cls._executor is executor:
+                cls._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, fn, *args):
+        slots = PasswordHelper._slots
+        if not slots.acquire(blocking=False):
+            raise PasswordPoolBusy('Server is busy, please try again shortly')
+        executor = self._pool()
         try:
-            return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-        except Exception as e:
-            return jsonify({'message': 'Error hashing password error', 'status': 500}), 500
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            slots.release()
+            self._discard(executor)
+            raise PasswordPoolBusy('Server is busy, please try again shortly')
+        except Exception:
+            slots.release()
+            raise
+
+        def done(f):
+            slots.release()
+            if not f.cancelled() and isinstance(f.exception(), BrokenProcessPool):
+                self._discard(executor)
+
+        future.add_done_callback(done)
+        return future
+
+    def _run(self, fn, *args):
+        future = self._submit(fn, *args)
+        try:
+            return future.result(timeout=env['password-pool-timeout'])
+        except (FutureTimeoutError, BrokenProcessPool):
+            future.cancel()
+            raise PasswordPoolBusy('Server is busy, please try again shortly')
+
+    def hash_password(self, password):
+        return self._run(_hash_password, password, env['bcrypt-rounds'])
 
     def check_password(self,password, hashed_password):
+        if not hashed_password:
+            return False
+        return self._run(_check_password, password, hashed_password)
+
+    def needs_rehash(self, hashed_password):
         try:
-            return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
-        except Exception as e:
-            return jsonify({'message': 'Error checking password error', 'status': 500}), 500
+            return int(hashed_password.split('$')[2]) != env['bcrypt-rounds']
+        except (AttributeError, IndexError, ValueError):
+            return False
         
 class CodeHelper:
 
@@ -159,17 +441,312 @@ class AuthorizationHelper:
                 'role': role,
                 'company_id': company_id,
                 'user_id': user_id,
-                'jti': jti
+                'jti': jti,
+                'exp': claims.get('exp')
             }
         except Exception as e:
             return jsonify({'message': 'Error getting token error', 'status': 500}), 500
         
+class PrincipalHelper:
+    # The authenticated user is loaded at most once per request (kept on flask.g) and
+    # shared between a worker's requests for principal-cache-seconds. Writes to a user call
+    # invalidate(); other workers pick the change up when their copy expires.
+    _cache = {}
+    _lock = threading.Lock()
+
+    def load(self, user_id, company_id, email):
+        return db.session.query(
+            User.id,
+            User.email,
+            User.firstname,
+            User.lastname,
+            User.role,
+            User.company_id,
+            User.supervisor_id,
+            User.approver_id,
+            User.is_active
+        ).filter(User.id == user_id, User.company_id == company_id, User.email == email, User.is_archived == False).first()
+
+    def current(self, token):
+        if not isinstance(token, dict):
+            return None
+        key = (str(token.get('user_id')), str(token.get('company_id')), token.get('email'))
+
+        principal = g.get('principal')
+        if principal is not None and g.get('principal_key') == key:
+            return principal
+
+        ttl = env['principal-cache-seconds']
+        cached = PrincipalHelper._cache.get(key)
+        if ttl and cached and cached[0] > time.time():
+            principal = cached[1]
+        else:
+            principal = self.load(*key)
+            if ttl and principal is not None:
+                with PrincipalHelper._lock:
+                    PrincipalHelper._cache[key] = (time.time() + ttl, principal)
+
+        g.principal = principal
+        g.principal_key = key
+        return principal
+
+    def invalidate(self, user_id):
+        user_id = str(user_id)
+        with PrincipalHelper._lock:
+            for key in [key for key in PrincipalHelper._cache if key[0] == user_id]:
+                del PrincipalHelper._cache[key]
+        if g.get('principal_key') and g.principal_key[0] == user_id:
+            g.pop('principal', None)
+            g.pop('principal_key', None)
+
+class BloomFilter:
+
+    def __init__(self, size=1 << 20, hashes=7):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bytearray(size // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+class TokenBlocklistHelper:
+    # Revoked jtis live in Redis with the token's remaining lifetime; each worker keeps a
+    # bloom filter of them so the common "not revoked" check never leaves the process.
+    # Postgres only keeps a durable copy and answers checks while Redis is unavailable.
+    # Revocations written during an outage reach Redis through restore(), which the next
+    # successful refresh runs after any Redis error, or when Redis comes back without its data.
+    key_prefix = 'blocklist:jti:'
+    index_key = 'blocklist:jtis'
+    seeded_key = 'blocklist:seeded'
+
+    _bloom = None
+    _loaded_at = 0
+    _needs_restore = False
+    _lock = threading.Lock()
+
+    def revoke(self, jti, expires_at=None):
+        now = time.time()
+        if not expires_at:
+            expires_at = now + env['jwt-refresh-token-expiration'].total_seconds()
+        ttl = max(int(expires_at - now), 1)
+
+        try:
+            pipe = redis_client.pipeline()
+            pipe.set(self.key_prefix + jti, 1, ex=ttl)
+            pipe.zadd(self.index_key, {jti: expires_at})
+            pipe.execute()
+        except redis.RedisError as e:
+            print(f"An error occurred: {e}")
+            self._outage()
+
+        bloom = TokenBlocklistHelper._bloom
+        if bloom is not None:
+            bloom.add(jti)
+
+        return DbHelper().add_record(BlacklistToken(jti=jti))
+
+    def is_revoked(self, jti):
+        bloom = self._refresh()
+        if bloom is not None:
+            if jti not in bloom:
+                return False
+        elif TokenBlocklistHelper._needs_restore:
+            # Redis failed recently; _refresh() tries it again once per refresh interval
+            return BlacklistToken.query.filter_by(jti=jti).first() is not None
+
+        try:
+            return redis_client.exists(self.key_prefix + jti) == 1
+        except redis.RedisError:
+            self._outage()
+            return BlacklistToken.query.filter_by(jti=jti).first() is not None
+
+    def _outage(self):
+        # Drop the bloom filter so checks go to Postgres until the next scheduled refresh, which
+        # reseeds Redis if it answers again. _loaded_at is kept so requests don't all retry Redis.
+        cls = TokenBlocklistHelper
+        cls._needs_restore = True
+        cls._bloom = None
+
+    def _refresh(self):
+        cls = TokenBlocklistHelper
+        if time.time() - cls._loaded_at < env['blocklist-refresh-seconds']:
+            return cls._bloom
+
+        with cls._lock:
+            now = time.time()
+            if now - cls._loaded_at < env['blocklist-refresh-seconds']:
+                return cls._bloom
+            try:
+                if cls._needs_restore or not redis_client.exists(self.seeded_key):
+                    self.restore()
+                    cls._needs_restore = False
+                pipe = redis_client.pipeline()
+                pipe.zremrangebyscore(self.index_key, '-inf', now)
+                pipe.zrange(self.index_key, 0, -1)
+                _, jtis = pipe.execute()
+                bloom = BloomFilter()
+                for jti in jtis:
+                    bloom.add(jti.decode('utf-8'))
+                cls._bloom = bloom
+            except redis.RedisError as e:
+                print(f"An error occurred: {e}")
+                cls._bloom = None
+                cls._needs_restore = True
+            cls._loaded_at = now
+            return cls._bloom
+
+    def restore(self):
+        # Reseed Redis from Postgres, e.g. after the Redis instance lost its data.
+        cutoff = datetime.now() - env['jwt-refresh-token-expiration']
+        tokens = BlacklistToken.query.filter(BlacklistToken.blacklisted_on >= cutoff).all()
+        pipe = redis_client.pipeline()
+        for token in tokens:
+            expires_at = (token.blacklisted_on + env['jwt-refresh-token-expiration']).timestamp()
+            pipe.set(self.key_prefix + token.jti, 1, ex=max(int(expires_at - time.time()), 1))
+            pipe.zadd(self.index_key, {token.jti: expires_at})
+        pipe.set(self.seeded_key, int(time.time()))
+        pipe.execute()
+        TokenBlocklistHelper._loaded_at = 0
+
+    def purge_expired(self):
+        # No token outlives the refresh lifetime, so older rows can never match again.
+        try:
+            cutoff = datetime.now() - env['jwt-refresh-token-expiration']
+            BlacklistToken.query.filter(BlacklistToken.blacklisted_on < cutoff).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            return str(e)
+
+@celery.task(name='purge_blacklist_tokens')
+def purge_blacklist_tokens():
+    TokenBlocklistHelper().purge_expired()
+
+class ResponseCacheHelper:
+    # Every company carries change versions in Redis: the default scope covers users, clients,
+    # projects and tasks, and the 'timesheets' scope covers timesheet and approval changes.
+    # Writes bump a version after committing. Reads derive a strong ETag from the versions they
+    # depend on plus the query string, answer If-None-Match with a 304 before touching Postgres,
+    # and key their cached JSON by that same ETag, so invalidation is a single INCR and superseded
+    # entries simply age out through their TTL. Versions restart at 0 if Redis loses its data, so
+    # every ETag also mixes in a random epoch that is only set while missing (like blocklist:seeded);
+    # tags issued before the loss can then never match again.
+    version_prefix = 'cache:version:'
+    epoch_key = 'cache:epoch'
+    metrics_key = 'cache:metrics'
+
+    def version_key(self, company_id, scope=None):
+        return f"{self.version_prefix}{company_id}:{scope}" if scope else f"{self.version_prefix}{company_id}"
+
+    def invalidate(self, company_id, scope=None):
+        # Called after the commit, so a reader can never tag pre-commit rows with the new version
+        try:
+            redis_client.incr(self.version_key(company_id, scope))
+        except redis.RedisError as e:
+            print(f"An error occurred: {e}")
+
+    def etag(self, resource, company_id, scopes=(None,), user_id=None):
+        epoch, *versions = redis_client.mget([self.epoch_key] + [self.version_key(company_id, scope) for scope in scopes])
+        if epoch is None:
+            redis_client.set(self.epoch_key, uuid.uuid4().hex, nx=True)
+            epoch = redis_client.get(self.epoch_key)
+        versions = [int(version or 0) for version in versions]
+        args = json.dumps(sorted(request.args.items(multi=True)))
+        return hashlib.sha1(f"{resource}:{company_id}:{user_id}:{epoch}:{versions}:{args}".encode('utf-8')).hexdigest()
+
+    def conditional(self, resource, company_id, scopes=(None,), user_id=None):
+        # Returns (304 response or None, etag); etag is None while Redis is unavailable
+        try:
+            etag = self.etag(resource, company_id, scopes, user_id)
+        except redis.RedisError as e:
+            print(f"An error occurred: {e}")
+            return None, None
+
+        # If-None-Match uses weak comparison, so strong and weak tags both validate
+        if request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304)
+            response.set_etag(etag)
+            return response, etag
+        return None, etag
+
+    def get(self, resource, etag):
+        if not etag:
+            return None
+        try:
+            body = redis_client.get(f"cache:{resource}:{etag}")
+            redis_client.hincrby(self.metrics_key, f"{resource}:{'hit' if body is not None else 'miss'}")
+        except redis.RedisError as e:
+            print(f"An error occurred: {e}")
+            return None
+
+        if body is None:
+            return None
+        response = current_app.response_class(body, mimetype='application/json')
+        response.headers['X-Cache'] = 'HIT'
+        response.set_etag(etag)
+        return response
+
+    def set(self, resource, etag, payload, store=True):
+        response = jsonify(payload)
+        if etag:
+            response.set_etag(etag)
+        if etag and store:
+            try:
+                redis_client.set(f"cache:{resource}:{etag}", response.get_data(), ex=env['response-cache-ttl'])
+                response.headers['X-Cache'] = 'MISS'
+            except redis.RedisError as e:
+                print(f"An error occurred: {e}")
+        return response
+
+    def metrics(self):
+        counts = {field.decode('utf-8'): int(value) for field, value in redis_client.hgetall(self.metrics_key).items()}
+        result = {}
+        for field, value in counts.items():
+            resource, outcome = field.rsplit(':', 1)
+            result.setdefault(resource, {'hit': 0, 'miss': 0})[outcome] = value
+        for stats in result.values():
+            total = stats['hit'] + stats['miss']
+            stats['hit_ratio'] = round(stats['hit'] / total, 4) if total else 0
+        return result
+
+aws_config = Config(
+    max_pool_connections=env['aws-max-pool-connections'],
+    connect_timeout=env['aws-connect-timeout'],
+    read_timeout=env['aws-read-timeout'],
+    retries={'max_attempts': 3, 'mode': 'standard'}
+)
+aws_clients = {}
+aws_clients_lock = threading.Lock()
+
+def aws_client(service, region_name, **kwargs):
+    # One client per service/region per process; boto3 clients are thread-safe once built,
+    # but building them on the shared default session is not, hence the lock.
+    key = (os.getpid(), service, region_name)
+    client = aws_clients.get(key)
+    if client is None:
+        with aws_clients_lock:
+            client = aws_clients.get(key)
+            if client is None:
+                client = boto3.session.Session().client(service, region_name=region_name, config=aws_config, **kwargs)
+                aws_clients[key] = client
+    return client
+
 class AwsHelper:
 
     def __init__(self):
-        self.client_sqs = boto3.client('sqs', region_name='us-east-2')
+        self.client_sqs = aws_client('sqs', 'us-east-2')
         
-        self.client_ses = boto3.client('ses', region_name='us-east-1')
+        self.client_ses = aws_client('ses', 'us-east-1')
         
         if not env['aws_access_key_id'] or not env['aws_secret_access_key_id']:
             raise ValueError("AWS credentials are missing. Please set 'aws_access_key_id' and 'aws_secret_access_key_id'.")
@@ -202,14 +779,167 @@ class AwsHelper:
         except Exception as e:
             print(f"An error occurred: {e}")
             return str(e)
+
+    def send_message_batch(self, queue_url, entries):
+        try:
+            return self.client_sqs.send_message_batch(
+                QueueUrl=queue_url,
+                Entries=entries
+            )
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            return str(e)
         
     
 
+# Email bodies are compiled once per process; autoescape keeps user-supplied names and feedback inert.
+email_environment = Environment(loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), 'templates', 'email')),
+                                autoescape=True, trim_blocks=True, lstrip_blocks=True)
+email_templates = {name: email_environment.get_template(name) for name in email_environment.list_templates()}
+
+class EmailHelper:
+    source = 'contact@digitalshelfiq.com'
+
+    def render(self, template, destination, subject, **context):
+        return {
+            "source": self.source,
+            "destination": destination,
+            "subject": subject,
+            "body_html": email_templates[template].render(url=env['url'], **context)
+        }
+
+    def approval_request(self, approver, user, timesheet):
+        context = {
+            'approver': approver.firstname,
+            'employee': f"{user.firstname} {user.lastname or ''}".strip(),
+            'timesheet': timesheet.name,
+            'timesheet_id': str(timesheet.id),
+            'start_date': str(timesheet.start_date),
+            'end_date': str(timesheet.end_date)
+        }
+        email_task = self.render('approval_request.html', approver.email, 'Timesheet Approval Request', **context)
+        # Kept so drain() can fold this request into a per-approver digest
+        email_task['digest'] = context
+        return email_task
+
+    def approval_digest(self, payloads):
+        requests = [payload['digest'] for payload in payloads]
+        return self.render('approval_digest.html', payloads[0]['destination'],
+                           f'{len(requests)} Timesheets Awaiting Approval',
+                           approver=requests[0]['approver'], requests=requests)
+
+class OutboxHelper:
+    # Notifications are written to the outbox in the same transaction as the state change
+    # and published to SQS later by drain(), so a request never waits on (or loses) a send.
+    # Publishing is at-least-once (a drain whose commit fails publishes again, SQS may redeliver);
+    # every message carries its dedup_key and the consumer sends each key once, see EmailDedupHelper.
+
+    def add(self, payload, dedup_key=None, digest_key=None):
+        message = OutboxMessage(payload=payload)
+        if dedup_key:
+            message.dedup_key = dedup_key
+        window = env['email-digest-window-seconds']
+        if digest_key and window:
+            # Held for the window; drain() sends every pending message sharing the key as one email
+            message.digest_key = digest_key
+            message.next_attempt_on = datetime.now() + timedelta(seconds=window)
+        db.session.add(message)
+        return message
+
+    def add_many(self, payloads):
+        # One multi-row insert for a batch of notifications, e.g. the welcome emails of a bulk import
+        if payloads:
+            db.session.execute(insert(OutboxMessage), [{'payload': payload} for payload in payloads])
+
+    def payload(self, group):
+        if len(group) == 1:
+            return {key: value for key, value in group[0].payload.items() if key != 'digest'}
+        return EmailHelper().approval_digest([message.payload for message in group])
+
+    def drain(self, batch_size=None):
+        batch_size = batch_size or env['outbox-batch-size']
+        now = datetime.now()
+        messages = OutboxMessage.query.filter(
+            OutboxMessage.sent_on.is_(None),
+            OutboxMessage.next_attempt_on <= now,
+            OutboxMessage.attempts < env['outbox-max-attempts']
+        ).order_by(OutboxMessage.next_attempt_on).limit(batch_size).with_for_update(skip_locked=True).all()
+
+        if not messages:
+            db.session.commit()
+            return 0
+
+        # A due digest message releases every pending message for the same recipient, even ones still inside their window
+        digest_keys = {message.digest_key for message in messages if message.digest_key}
+        if digest_keys:
+            messages += OutboxMessage.query.filter(
+                OutboxMessage.digest_key.in_(digest_keys),
+                OutboxMessage.sent_on.is_(None),
+                OutboxMessage.attempts < env['outbox-max-attempts'],
+                OutboxMessage.id.notin_([message.id for message in messages])
+            ).with_for_update(skip_locked=True).all()
+
+        groups = {}
+        for message in messages:
+            groups.setdefault(message.digest_key or message.id, []).append(message)
+        groups = list(groups.values())
+
+        aws = AwsHelper()
+        sent = 0
+        # SendMessageBatch takes at most 10 entries
+        for start in range(0, len(groups), 10):
+            chunk = groups[start:start + 10]
+            entries = [{
+                'Id': str(index),
+                'MessageBody': json.dumps(dict(self.payload(group), dedup_key=group[0].dedup_key)),
+                'MessageAttributes': {'dedup_key': {'DataType': 'String', 'StringValue': group[0].dedup_key}}
+            } for index, group in enumerate(chunk)]
+
+            response = aws.send_message_batch(env['sqs_url'], entries)
+            if isinstance(response, str):
+                failed = {str(index): response for index in range(len(chunk))}
+            else:
+                failed = {failure['Id']: failure.get('Message', failure.get('Code')) for failure in response.get('Failed', [])}
+
+            for index, group in enumerate(chunk):
+                error = failed.get(str(index))
+                for message in group:
+                    if error is None:
+                        message.sent_on = now
+                        sent += 1
+                    else:
+                        message.attempts += 1
+                        message.last_error = error
+                        message.next_attempt_on = now + timedelta(seconds=min(2 ** message.attempts, 3600))
+
+        db.session.commit()
+        return sent
+
+class EmailDedupHelper:
+    # Delivery-side half of the outbox dedup keys: a message's key is claimed with SET NX before
+    # it is emailed, so a republished or redelivered copy finds the claim and is skipped. A send
+    # that fails releases its claim so the redelivery can go out. Claims outlive SQS retention.
+    key_prefix = 'email:sent:'
+
+    def claim(self, dedup_key):
+        return bool(redis_client.set(self.key_prefix + dedup_key, 1, nx=True, ex=env['email-dedup-seconds']))
+
+    def release(self, dedup_key):
+        redis_client.delete(self.key_prefix + dedup_key)
+
+@celery.task(name='drain_outbox')
+def drain_outbox():
+    try:
+        return OutboxHelper().drain()
+    except Exception as e:
+        db.session.rollback()
+        print(f"An error occurred: {e}")
+
 class S3Helper:
 
     def __init__(self):
-        self.client_s3 = boto3.client('s3', aws_access_key_id=env['aws_access_key_id'],
-                                  aws_secret_access_key=env['aws_secret_access_key_id'], region_name='us-east-2')
+        self.client_s3 = aws_client('s3', 'us-east-2', aws_access_key_id=env['aws_access_key_id'],
+                                    aws_secret_access_key=env['aws_secret_access_key_id'])
         
         
     # Returns a list of all buckets 
@@ -306,29 +1036,492 @@ class S3Helper:
             print(f"An error occurred: {e}")
             return str(e)
         
+class ExportHelper:
+    # Company-wide timesheet hours for payroll. Rows come off a server-side cursor (yield_per) and
+    # are encoded into chunks of batch_size rows, so memory stays flat however long the export is.
+    batch_size = 2000
+    formats = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+    columns = [
+        'user_id', 'firstname', 'lastname', 'email',
+        'timesheet_id', 'timesheet_name', 'start_date', 'end_date', 'approval',
+        'client_id', 'client_name', 'project_id', 'project_name', 'task_id', 'task_name',
+        'mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun', 'total'
+    ]
+
+    def rows(self, company_id, start_date, end_date, approval=None):
+        # Every timesheet overlapping [start_date, end_date] for the company, one row per active task line
+        query = db.session.query(
+            User.id.label('user_id'),
+            User.firstname,
+            User.lastname,
+            User.email,
+            Timesheet.id.label('timesheet_id'),
+            Timesheet.name.label('timesheet_name'),
+            Timesheet.start_date,
+            Timesheet.end_date,
+            Timesheet.approval,
+            Client.id.label('client_id'),
+            Client.name.label('client_name'),
+            Project.id.label('project_id'),
+            Project.name.label('project_name'),
+            Task.id.label('task_id'),
+            Task.name.label('task_name'),
+            TaskHours.values
+        ).select_from(TaskHours) \
+        .join(Timesheet, TaskHours.timesheet_id == Timesheet.id) \
+        .join(User, Timesheet.user_id == User.id) \
+        .join(Task, TaskHours.task_id == Task.id) \
+        .join(Project, Task.project_id == Project.id) \
+        .join(Client, Project.client_id == Client.id) \
+        .filter(
+            User.company_id == company_id,
+            User.is_archived == False,
+            Timesheet.is_archived == False,
+            Timesheet.start_date <= end_date,
+            Timesheet.end_date >= start_date,
+            TaskHours.is_active == True
+        )
+
+        if approval:
+            query = query.filter(Timesheet.approval == approval)
+
+        return query.order_by(Timesheet.start_date, User.id, Timesheet.id, TaskHours.created_at, TaskHours.id) \
+            .execution_options(yield_per=self.batch_size)
+
+    def record(self, row):
+        values = list(row.values)
+        return dict(zip(self.columns, [
+            str(row.user_id), row.firstname, row.lastname, row.email,
+            str(row.timesheet_id), row.timesheet_name,
+            row.start_date.strftime('%Y-%m-%d'), row.end_date.strftime('%Y-%m-%d'),
+            row.approval.value if row.approval else None,
+            str(row.client_id), row.client_name, str(row.project_id), row.project_name,
+            str(row.task_id), row.task_name,
+            *values, sum(values)
+        ]))
+
+    def cell(self, value):
+        # The CSV is opened in spreadsheets; a user-entered value that starts like a formula is
+        # prefixed with ' so it is shown as text instead of being evaluated (CSV injection)
+        if isinstance(value, str) and value.startswith(('=', '+', '-', '@', '\t', '\r')):
+            return "'" + value
+        return value
+
+    def encode(self, rows, fmt):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if fmt == 'csv' else None
+        if writer:
+            writer.writerow(self.columns)
+
+        for count, row in enumerate(rows, 1):
+            record = self.record(row)
+            if writer:
+                writer.writerow([self.cell(value) for value in record.values()])
+            else:
+                buffer.write(json.dumps(record) + '\n')
+
+            if count % self.batch_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    def key(self, company_id, fmt):
+        return f'exports/{company_id}/taskhours-{uuid7()}.{fmt}'
+
+    def error_key(self, key):
+        # Written next to the export when it fails, so clients polling the export can stop waiting
+        return f'{key}.error'
+
+    def upload(self, company_id, start_date, end_date, fmt, key, approval=None):
+        # Spools to a temporary file rather than memory, then lets boto3 multipart-upload it
+        with tempfile.NamedTemporaryFile('w', suffix=f'.{fmt}', newline='', delete=False) as file:
+            path = file.name
+            for chunk in self.encode(self.rows(company_id, start_date, end_date, approval), fmt):
+                file.write(chunk)
+        try:
+            error = S3Helper().upload_file_to_object(path, env['bucket_name'], key)
+        finally:
+            os.remove(path)
+        if error:
+            raise RuntimeError(error)
+
+@celery.task(name='export_taskhours')
+def export_taskhours(company_id, start_date, end_date, fmt, key, approval=None):
+    export = ExportHelper()
+    try:
+        export.upload(
+            company_id, date.fromisoformat(start_date), date.fromisoformat(end_date), fmt, key,
+            Approval(approval) if approval else None
+        )
+    except Exception as e:
+        db.session.rollback()
+        print(f"An error occurred: {e}")
+        S3Helper().put_object_in_s3(str(e).encode(), env['bucket_name'], export.error_key(key))
+
+class ImportHelper:
+    # Bulk onboarding from CSV. The upload is COPYed into a temporary staging table, checked
+    # with set-based queries (any invalid row rejects the whole file), rows already present in
+    # the company or repeated in the file are skipped, and the rest go in with one INSERT ...
+    # SELECT. History, counters and welcome emails are written in the same transaction.
+    # Rows refer to their parents by natural key (emails and names), never by id.
+    max_errors = 100
+    kinds = {
+        'users': {
+            'model': User,
+            'counter': 'employees',
+            # No password column: every imported user sets their own through the emailed link
+            'columns': ['firstname', 'lastname', 'email', 'role', 'phone', 'gender', 'supervisor_email', 'approver_email'],
+            'required': ['firstname', 'email', 'role', 'gender', 'supervisor_email', 'approver_email'],
+            'key': ['email'],
+            'existing': '''SELECT 1 FROM "user" t WHERE t.company_id = :company_id AND t.is_archived = false AND t.email = s.email''',
+            # Supervisors and approvers may be existing users or other rows of the same file
+            'references': {
+                'supervisor_email': '''coalesce(
+                    (SELECT t.id FROM "user" t WHERE t.company_id = :company_id AND t.is_archived = false AND t.email = s.supervisor_email LIMIT 1),
+                    (SELECT o.target_id FROM import_rows o WHERE o.email = s.supervisor_email AND NOT o.skip))''',
+                'approver_email': '''coalesce(
+                    (SELECT t.id FROM "user" t WHERE t.company_id = :company_id AND t.is_archived = false AND t.email = s.approver_email LIMIT 1),
+                    (SELECT o.target_id FROM import_rows o WHERE o.email = s.approver_email AND NOT o.skip))'''
+            },
+            'values': {
+                'firstname': 's.firstname', 'lastname': "nullif(s.lastname, '')", 'role': 's.role', 'email': 's.email',
+                'phone': "nullif(s.phone, '')", 'gender': 's.gender', 'company_id': ':company_id',
+                'supervisor_id': '{supervisor_email}', 'approver_id': '{approver_email}'
+            },
+            'returning': ['id', 'firstname', 'lastname', 'role', 'email', 'phone', 'gender', 'supervisor_id', 'approver_id']
+        },
+        'clients': {
+            'model': Client,
+            'counter': 'clients',
+            'columns': ['name', 'email', 'phone'],
+            'required': ['name', 'email'],
+            'key': ['email'],
+            'existing': '''SELECT 1 FROM client t WHERE t.company_id = :company_id AND t.is_archived = false AND t.email = s.email''',
+            'references': {},
+            'values': {'name': 's.name', 'email': 's.email', 'phone': "nullif(s.phone, '')", 'company_id': ':company_id'},
+            'returning': ['id', 'name', 'email', 'phone']
+        },
+        'projects': {
+            'model': Project,
+            'counter': 'projects',
+            'columns': ['name', 'client_email', 'start_date', 'end_date', 'estimated_hours', 'estimated_cost'],
+            'required': ['name', 'client_email'],
+            'key': ['client_email', 'name'],
+            'existing': '''SELECT 1 FROM project t JOIN client c ON t.client_id = c.id
+                WHERE c.company_id = :company_id AND c.is_archived = false AND c.email = s.client_email
+                AND t.is_archived = false AND t.name = s.name''',
+            'references': {
+                'client_email': '''(SELECT c.id FROM client c WHERE c.company_id = :company_id AND c.is_archived = false
+                    AND c.email = s.client_email ORDER BY c.created_at LIMIT 1)'''
+            },
+            'values': {
+                'name': 's.name', 'client_id': '{client_email}',
+                'start_date': "nullif(s.start_date, '')::date", 'end_date': "nullif(s.end_date, '')::date",
+                'estimated_hours': "nullif(s.estimated_hours, '')::integer", 'estimated_cost': "nullif(s.estimated_cost, '')::integer"
+            },
+            'returning': ['id', 'name', 'client_id', 'start_date', 'end_date', 'estimated_hours', 'estimated_cost']
+        },
+        'tasks': {
+            'model': Task,
+            'counter': 'tasks',
+            'columns': ['name', 'client_email', 'project_name', 'start_date', 'end_date', 'billable_type'],
+            'required': ['name', 'client_email', 'project_name'],
+            'key': ['client_email', 'project_name', 'name'],
+            'existing': '''SELECT 1 FROM task t JOIN project p ON t.project_id = p.id JOIN client c ON p.client_id = c.id
+                WHERE c.company_id = :company_id AND c.is_archived = false AND c.email = s.client_email
+                AND p.is_archived = false AND p.name = s.project_name AND t.is_archived = false AND t.name = s.name''',
+            'references': {
+                'project_name': '''(SELECT p.id FROM project p JOIN client c ON p.client_id = c.id
+                    WHERE c.company_id = :company_id AND c.is_archived = false AND c.email = s.client_email
+                    AND p.is_archived = false AND p.name = s.project_name ORDER BY p.created_at LIMIT 1)'''
+            },
+            'values': {
+                'name': 's.name', 'project_id': '{project_name}',
+                'start_date': "nullif(s.start_date, '')::date", 'end_date': "nullif(s.end_date, '')::date",
+                'billable_type': "coalesce(nullif(upper(replace(s.billable_type, '-', '_')), ''), 'BILLABLE')::billabletype"
+            },
+            'returning': ['id', 'name', 'project_id', 'start_date', 'end_date', 'billable_type']
+        }
+    }
+    # Text checks run before any cast, so a bad value is reported against its line instead of failing the INSERT
+    formats = {
+        'phone': '^[0-9]{1,10}$',
+        'start_date': '^[0-9]{4}-[0-9]{2}-[0-9]{2}$',
+        'end_date': '^[0-9]{4}-[0-9]{2}-[0-9]{2}$',
+        'estimated_hours': '^[0-9]{1,9}$',
+        'estimated_cost': '^[0-9]{1,9}$',
+        'billable_type': '(?i)^(billable|non[-_]billable|both)$'
+    }
+
+    def stage(self, spec, stream):
+        # The header picks and orders the staged columns; only known column names reach the COPY
+        reader = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        header = [column.strip().lower() for column in next(csv.reader([reader.readline()]), [])]
+
+        unknown = [column for column in header if column not in spec['columns']]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+        missing = [column for column in spec['required'] if column not in header]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+
+        cursor = db.session.connection().connection.cursor()
+        cursor.execute(f"""
+            CREATE TEMPORARY TABLE import_rows (
+                line SERIAL PRIMARY KEY,
+                {', '.join(f'{column} TEXT' for column in spec['columns'])},
+                target_id UUID,
+                skip BOOLEAN NOT NULL DEFAULT false
+            ) ON COMMIT DROP""")
+        try:
+            cursor.copy_expert(f"COPY import_rows ({', '.join(header)}) FROM STDIN WITH (FORMAT csv)", reader)
+        except psycopg2.DataError as e:
+            cursor.close()
+            raise ValueError(str(e).splitlines()[0])
+        # Temporary tables are never auto-analyzed; the key index serves dedup and in-file references
+        cursor.execute(f"CREATE INDEX ON import_rows ({', '.join(spec['key'])})")
+        cursor.execute("ANALYZE import_rows")
+        return cursor
+
+    def dedup(self, spec, params):
+        # Skip rows the company already has, and every repeat of a key after its first line
+        db.session.execute(text(f"""
+            UPDATE import_rows s SET skip = true
+            FROM (SELECT line, row_number() OVER (PARTITION BY {', '.join(spec['key'])} ORDER BY line) AS occurrence
+                  FROM import_rows) r
+            WHERE r.line = s.line AND (r.occurrence > 1 OR EXISTS ({spec['existing']}))"""), params)
+
+    def assign(self, cursor):
+        # Ids are made here (uuid7, like every other insert) so rows of one file can reference each other
+        lines = db.session.execute(text("SELECT line FROM import_rows WHERE NOT skip")).scalars().all()
+        execute_values(cursor, """
+            UPDATE import_rows s SET target_id = v.id::uuid
+            FROM (VALUES %s) v(line, id) WHERE s.line = v.line""",
+            [(line, str(uuid7())) for line in lines], page_size=1000)
+        return len(lines)
+
+    def validate(self, spec, params):
+        checks = [f"SELECT line, '{column} is required' FROM import_rows WHERE coalesce(trim({column}), '') = ''"
+                  for column in spec['required']]
+        checks += [f"SELECT line, '{column} is invalid' FROM import_rows WHERE coalesce({column}, '') <> '' AND {column} !~ '{pattern}'"
+                   for column, pattern in self.formats.items() if column in spec['columns']]
+        checks += [f"SELECT line, '{column} not found' FROM import_rows s WHERE NOT s.skip AND coalesce(s.{column}, '') <> '' AND {lookup} IS NULL"
+                   for column, lookup in spec['references'].items()]
+
+        rows = db.session.execute(text(f"""
+            SELECT line + 1 AS line, message FROM ({' UNION ALL '.join(checks)}) errors
+            ORDER BY line LIMIT {self.max_errors}"""), params).all()
+        # Reported as file line numbers, counting the header
+        return [{'line': row.line, 'message': row.message} for row in rows]
+
+    def recipients(self):
+        return db.session.execute(text("""
+            SELECT firstname, email FROM import_rows WHERE NOT skip ORDER BY line""")).all()
+
+    def insert(self, spec, params):
+        now = datetime.now()
+        values = dict({key: value.format(**spec['references']) for key, value in spec['values'].items()},
+                      id='s.target_id', is_active='true', is_archived='false',
+                      created_date=':today', created_time=':time', updated_date=':today', updated_time=':time',
+                      created_by="'app'", updated_by="'app'")
+        rows = db.session.execute(text(f"""
+            INSERT INTO "{spec['model'].__tablename__}" ({', '.join(values)})
+            SELECT {', '.join(values.values())} FROM import_rows s WHERE NOT s.skip ORDER BY s.line
+            RETURNING {', '.join(spec['returning'])}"""), dict(params, today=now.date(), time=now.time())).all()
+        return [dict(row._mapping) for row in rows]
+
+    def run(self, kind, company_id, user_id, stream):
+        # Returns (summary, errors); nothing is written unless errors is empty
+        spec = self.kinds[kind]
+        params = {'company_id': company_id}
+        db_helper = DbHelper()
+
+        cursor = self.stage(spec, stream)
+        try:
+            self.dedup(spec, params)
+            pending = self.assign(cursor)
+            errors = self.validate(spec, params)
+            if errors:
+                db.session.rollback()
+                return None, errors
+
+            total = db.session.execute(text("SELECT count(*) FROM import_rows")).scalar()
+            users = self.recipients() if spec['model'] is User and pending else []
+        finally:
+            cursor.close()
+
+        rows = self.insert(spec, params) if pending else []
+        if rows:
+            db.session.execute(insert(HistoryLogger), db_helper.history_rows([{
+                'table_name': spec['model'].__tablename__,
+                'record_id': str(row['id']),
+                'operation': 'insert',
+                'old_data': None,
+                'new_data': json.dumps(row, default=str),
+                'user_id': str(user_id) if user_id else None
+            } for row in rows]))
+            CounterHelper().record(company_id, spec['counter'], total=len(rows), active=len(rows))
+
+        # Same set-password email as add_user, queued as one multi-row outbox insert
+        email, code = EmailHelper(), CodeHelper()
+        OutboxHelper().add_many([email.render('account_credentials.html', user.email, "Timechronos Account Credentials",
+                                              firstname=user.firstname, email=user.email, token=code.generate_reset_token(user.email))
+                                 for user in users])
+
+        error = db_helper.update_record()
+        if error:
+            raise RuntimeError(error)
+        return {'total': total, 'imported': len(rows), 'skipped': total - len(rows)}, []
+
+class RateLimiter:
+    # Spaces calls evenly at `rate` per second across threads
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def send_queued_emails(records, ses, max_workers=None, send_rate=None, dedup=None):
+    # ses is anything with AwsHelper.send_email's signature (returns an error string on failure),
+    # and dedup anything with EmailDedupHelper's claim/release, so stubs can stand in locally.
+    # A record that does not parse can never succeed, so it is logged and dropped rather than
+    # reported back for redelivery; only failed sends are returned as batchItemFailures.
+    # A record whose dedup_key is already claimed was sent before (a republish, or a redelivery
+    # of a batch that failed as a whole) and is skipped.
+    limiter = RateLimiter(send_rate or env['ses-max-send-rate'])
+    dedup = dedup or EmailDedupHelper()
+
+    messages = []
+    for record in records:
+        try:
+            message = json.loads(record['body'])
+            email = (message['source'], message['destination'], message['subject'], message['body_html'])
+            messages.append((record, message.get('dedup_key'), email))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f"Dropping malformed message {record.get('messageId')}: {e!r}")
+
+    def send(record, dedup_key, email):
+        if dedup_key and not dedup.claim(dedup_key):
+            print(f"Skipping already sent message {record.get('messageId')}")
+            return
+        limiter.acquire()
+        error = ses.send_email(*email)
+        if error:
+            if dedup_key:
+                try:
+                    dedup.release(dedup_key)
+                except redis.RedisError as e:
+                    print(f"An error occurred: {e}")
+            raise RuntimeError(error)
+
+    failures = []
+    with ThreadPoolExecutor(max_workers=max_workers or env['ses-max-workers']) as pool:
+        futures = {pool.submit(send, record, dedup_key, email): record for record, dedup_key, email in messages}
+        for future in as_completed(futures):
+            error = future.exception()
+            if error:
+                print(f"An error occurred: {error}")
+                failures.append({'itemIdentifier': futures[future]['messageId']})
+    return {'batchItemFailures': failures}
+
 def lambda_handler(event, context):
+        records = event.get('Records', [])
         try:
             ses = AwsHelper()
             print("Processing SQS messages...")
-        
-            for record in event['Records']:
-                message = json.loads(record['body'])
-                
-                source = message['source']
-                destination = message['destination']
-                subject = message['subject']
-                body_html = message['body_html']
-                
-                ses.send_email(source, destination, subject, body_html)
-
-            return {
-                'statusCode': 200,
-                'body': 'Emails processed successfully'
-            }
+            # Only the failed messages go back to the queue (requires ReportBatchItemFailures)
+            return send_queued_emails(records, ses)
         except Exception as e:
             print(f"An error occurred: {e}")
-            return str(e) 
+            return {'batchItemFailures': [{'itemIdentifier': record['messageId']} for record in records]}
         
+class CalendarHelper:
+    # In-process equivalent of dim_date: one slot per day from 2016-01-01, the same range
+    # dim_date_insert generates, so week/month/quarter lookups never touch the database.
+    start = date(2016, 1, 1)
+    days = 29220
+
+    _day_of_week = None
+    _week_of_year = None
+    _year_actual = None
+    _month_actual = None
+    _quarter_actual = None
+
+    def __init__(self):
+        if CalendarHelper._day_of_week is None:
+            self._build()
+
+    @classmethod
+    def _build(cls):
+        day_of_week, week_of_year, year_actual = array('B'), array('B'), array('H')
+        month_actual, quarter_actual = array('B'), array('B')
+        for offset in range(cls.days):
+            day = cls.start + timedelta(days=offset)
+            iso_year, iso_week, iso_day = day.isocalendar()
+            day_of_week.append(iso_day)
+            week_of_year.append(iso_week)
+            year_actual.append(iso_year)
+            month_actual.append(day.month)
+            quarter_actual.append((day.month - 1) // 3 + 1)
+        cls._week_of_year, cls._year_actual = week_of_year, year_actual
+        cls._month_actual, cls._quarter_actual = month_actual, quarter_actual
+        cls._day_of_week = day_of_week
+
+    def offset(self, day):
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        elif isinstance(day, datetime):
+            day = day.date()
+        offset = (day - self.start).days
+        if not 0 <= offset < self.days:
+            raise ValueError(f'Date {day} is outside the calendar range')
+        return offset
+
+    def lookup(self, day):
+        offset = self.offset(day)
+        day = self.start + timedelta(days=offset)
+        day_of_week = self._day_of_week[offset]
+        month = self._month_actual[offset]
+        quarter = self._quarter_actual[offset]
+        first_month_of_quarter = 3 * (quarter - 1) + 1
+        return {
+            'date_actual': day,
+            'day_of_week': day_of_week,
+            'week_of_year': self._week_of_year[offset],
+            'year_actual': self._year_actual[offset],
+            'month_actual': month,
+            'quarter_actual': quarter,
+            'first_day_of_week': day - timedelta(days=day_of_week - 1),
+            'last_day_of_week': day + timedelta(days=7 - day_of_week),
+            'first_day_of_month': day.replace(day=1),
+            'last_day_of_month': day.replace(day=monthrange(day.year, month)[1]),
+            'first_day_of_quarter': date(day.year, first_month_of_quarter, 1),
+            'last_day_of_quarter': date(day.year, first_month_of_quarter + 2, monthrange(day.year, first_month_of_quarter + 2)[1]),
+            'weekend_indr': day_of_week in (6, 7)
+        }
+
+    def lookup_range(self, start_day, end_day):
+        # Column slices for every day in [start_day, end_day]
+        first, last = self.offset(start_day), self.offset(end_day) + 1
+        return {
+            'date_actual': [self.start + timedelta(days=offset) for offset in range(first, last)],
+            'day_of_week': self._day_of_week[first:last],
+            'week_of_year': self._week_of_year[first:last],
+            'year_actual': self._year_actual[first:last],
+            'month_actual': self._month_actual[first:last],
+            'quarter_actual': self._quarter_actual[first:last]
+        }
+
 # DimDate query        
 dim_date_insert = """
 INSERT INTO dim_date
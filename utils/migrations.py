@@ -0,0 +1,222 @@
+from utils.models import db
+from sqlalchemy.sql import text
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.dialects import postgresql
+
+def model_index(name):
+    for table in db.metadata.tables.values():
+        for index in table.indexes:
+            if index.name == name:
+                return index
+    raise KeyError(f"Index {name} is not declared on any model")
+
+def create_concurrently(*names):
+    # DDL for indexes declared in models.py, so create_all() and live databases get identical indexes
+    statements = []
+    for name in names:
+        ddl = str(CreateIndex(model_index(name), if_not_exists=True).compile(dialect=postgresql.dialect()))
+        statements.append(ddl.replace(' INDEX ', ' INDEX CONCURRENTLY ', 1))
+    return statements
+
+def drop_id_key(table):
+    # Drops the UNIQUE (id) constraint that duplicated the primary key index. Foreign keys that
+    # Postgres bound to that unique index are recreated NOT VALID afterwards so they bind to the
+    # primary key; validate_foreign_keys() checks them once the ACCESS EXCLUSIVE locks are released.
+    return f"""
+        DO $$
+        DECLARE
+            key_index oid;
+            fks jsonb;
+            fk record;
+        BEGIN
+            SELECT conindid INTO key_index FROM pg_constraint
+            WHERE conname = '{table}_id_key' AND conrelid = to_regclass('"{table}"');
+            IF key_index IS NULL THEN
+                RETURN;
+            END IF;
+
+            SELECT coalesce(jsonb_agg(jsonb_build_object(
+                'tbl', conrelid::regclass::text, 'name', conname, 'def', pg_get_constraintdef(oid))), '[]')
+            INTO fks FROM pg_constraint WHERE contype = 'f' AND conindid = key_index;
+
+            FOR fk IN SELECT * FROM jsonb_to_recordset(fks) AS x(tbl text, name text, def text) LOOP
+                EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', fk.tbl, fk.name);
+            END LOOP;
+            ALTER TABLE "{table}" DROP CONSTRAINT "{table}_id_key";
+            FOR fk IN SELECT * FROM jsonb_to_recordset(fks) AS x(tbl text, name text, def text) LOOP
+                EXECUTE format('ALTER TABLE %s ADD CONSTRAINT %I %s NOT VALID', fk.tbl, fk.name, fk.def);
+            END LOOP;
+        END $$"""
+
+def validate_foreign_keys():
+    # VALIDATE CONSTRAINT only takes SHARE UPDATE EXCLUSIVE, so reads and writes carry on while
+    # the referencing rows are scanned; each constraint is committed on its own.
+    return """
+        DO $$
+        DECLARE
+            fk record;
+        BEGIN
+            FOR fk IN SELECT conrelid::regclass::text AS tbl, conname AS name FROM pg_constraint
+                      WHERE contype = 'f' AND NOT convalidated
+                      AND connamespace = current_schema()::regnamespace LOOP
+                EXECUTE format('ALTER TABLE %s VALIDATE CONSTRAINT %I', fk.tbl, fk.name);
+                COMMIT;
+            END LOOP;
+        END $$"""
+
+def add_created_at(table):
+    # created_at replaces the created_date/created_time pair as the list sort key. The column is
+    # added without a rewrite, backfilled in committed batches walked by primary key, and only
+    # then made NOT NULL through a validated CHECK so the final step needs no table scan.
+    return [
+        f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS created_at TIMESTAMP WITH TIME ZONE',
+        f'ALTER TABLE "{table}" ALTER COLUMN created_at SET DEFAULT now()',
+        f"""
+        DO $$
+        DECLARE
+            last_id uuid := '00000000-0000-0000-0000-000000000000';
+            batch uuid[];
+        BEGIN
+            LOOP
+                SELECT array_agg(id ORDER BY id) INTO batch
+                FROM (SELECT id FROM "{table}" WHERE id > last_id ORDER BY id LIMIT 5000) ids;
+                EXIT WHEN batch IS NULL;
+
+                UPDATE "{table}"
+                SET created_at = coalesce((created_date + coalesce(created_time, time '00:00'))::timestamptz, now())
+                WHERE id = ANY(batch) AND created_at IS NULL;
+
+                last_id := batch[array_length(batch, 1)];
+                COMMIT;
+            END LOOP;
+        END $$""",
+        f'ALTER TABLE "{table}" DROP CONSTRAINT IF EXISTS {table}_created_at_not_null',
+        f'ALTER TABLE "{table}" ADD CONSTRAINT {table}_created_at_not_null CHECK (created_at IS NOT NULL) NOT VALID',
+        f'ALTER TABLE "{table}" VALIDATE CONSTRAINT {table}_created_at_not_null',
+        f'ALTER TABLE "{table}" ALTER COLUMN created_at SET NOT NULL',
+        f'ALTER TABLE "{table}" DROP CONSTRAINT {table}_created_at_not_null',
+    ]
+
+# Ordered schema changes that db.create_all() cannot roll out to a live database.
+# Each entry runs once; its id is recorded in schema_migrations after all statements succeed.
+# Statements run in autocommit mode so CREATE INDEX CONCURRENTLY never blocks writes,
+# and must be idempotent because a failed migration is retried from its first statement.
+migrations = [
+    ('0001_trigram_name_indexes', [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        # Must stay identical to the full-name expression filtered in UserController.user_list
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_full_name_trgm
+           ON "user" USING gin ((firstname || ' ' || coalesce(lastname, '')) gin_trgm_ops)""",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_client_name_trgm ON client USING gin (name gin_trgm_ops)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_project_name_trgm ON project USING gin (name gin_trgm_ops)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_task_name_trgm ON task USING gin (name gin_trgm_ops)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_timesheet_name_trgm ON timesheet USING gin (name gin_trgm_ops)",
+    ]),
+    ('0002_outbox_digest_key', [
+        "ALTER TABLE outbox ADD COLUMN IF NOT EXISTS digest_key VARCHAR(255)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_outbox_digest_key ON outbox (digest_key)",
+    ]),
+    ('0003_hot_path_indexes', create_concurrently(
+        'ix_user_company_id_is_archived',
+        'ix_user_approver_id',
+        'ix_user_email',
+        'ix_client_company_id_is_archived',
+        'ix_project_client_id_is_archived',
+        'ix_task_project_id_is_archived',
+        'ix_timesheet_user_id_is_archived_approval',
+        'ix_taskhours_timesheet_id_is_active',
+        'ix_blacklist_tokens_jti',
+        'ix_token_token',
+        'ix_outbox_pending',
+    ) + [
+        # Superseded by ix_timesheet_user_id_is_archived_approval
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_timesheet_user_id_approval",
+    ]),
+    ('0004_drop_redundant_id_keys', [drop_id_key(table) for table in (
+        'company', 'user', 'client', 'project', 'task', 'timesheet', 'taskhours',
+        'history_logger', 'blacklist_tokens', 'token', 'outbox'
+    )] + [validate_foreign_keys()]),
+    ('0005_created_at', [statement for table in (
+        'company', 'user', 'client', 'project', 'task', 'timesheet', 'taskhours',
+        'history_logger', 'blacklist_tokens', 'token', 'outbox'
+    ) for statement in add_created_at(table)] + create_concurrently(
+        'ix_user_company_id_created_at',
+        'ix_client_company_id_created_at',
+        'ix_timesheet_user_id_created_at',
+    )),
+    ('0006_name_lookup_indexes', create_concurrently(
+        'ix_company_name_is_archived',
+        'ix_project_name_is_archived_client_id',
+        'ix_task_name_is_archived_project_id',
+    )),
+]
+
+def drop_invalid_indexes(connection):
+    # An interrupted CREATE INDEX CONCURRENTLY leaves an invalid index behind, which
+    # IF NOT EXISTS would then skip forever; drop them so the retry rebuilds them.
+    invalid = connection.execute(text("""
+        SELECT i.relname FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_namespace n ON n.oid = i.relnamespace
+        WHERE NOT x.indisvalid AND n.nspname = current_schema()""")).scalars().all()
+    for name in invalid:
+        connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+        print(f"Dropped invalid index {name}.")
+
+def run_migrations():
+    applied_now = []
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                id VARCHAR(100) PRIMARY KEY,
+                applied_on TIMESTAMP NOT NULL DEFAULT now()
+            )"""))
+        applied = {row[0] for row in connection.execute(text("SELECT id FROM schema_migrations"))}
+        drop_invalid_indexes(connection)
+
+        for migration_id, statements in migrations:
+            if migration_id in applied:
+                continue
+            for statement in statements:
+                connection.execute(text(statement))
+            connection.execute(text("INSERT INTO schema_migrations (id) VALUES (:id)"), {'id': migration_id})
+            applied_now.append(migration_id)
+            print(f"Migration {migration_id} applied successfully.")
+    return applied_now
+
+def check_indexes():
+    # Every model query path must be the leading columns of an index declared on the model,
+    # and that index must exist (and be valid) in the database. Returns the failures.
+    with db.engine.connect() as connection:
+        existing = set(connection.execute(text("""
+            SELECT i.relname FROM pg_index x
+            JOIN pg_class i ON i.oid = x.indexrelid
+            JOIN pg_namespace n ON n.oid = i.relnamespace
+            WHERE x.indisvalid AND n.nspname = current_schema()""")).scalars().all())
+
+    failures = []
+    for mapper in db.Model.registry.mappers:
+        model = mapper.class_
+        table = mapper.local_table
+        for path in getattr(model, 'query_paths', []):
+            supporting = [index for index in table.indexes
+                          if {column.name for column in list(index.columns)[:len(path)]} == set(path)]
+            if not supporting:
+                failures.append(f"{table.name}{path}: no index declared")
+            elif not any(index.name in existing for index in supporting):
+                failures.append(f"{table.name}{path}: {supporting[0].name} missing from the database")
+    return failures
+
+if __name__ == '__main__':
+    # python -m utils.migrations [check]
+    # Deliberately not exposed over HTTP: migrations run DDL and the check reveals the schema.
+    import sys
+    from app import create_app
+
+    with create_app().app_context():
+        if sys.argv[1:] == ['check']:
+            failures = check_indexes()
+            for failure in failures:
+                print(failure)
+            sys.exit(1 if failures else 0)
+        run_migrations()
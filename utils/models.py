@@ -2,15 +2,31 @@ from flask import Blueprint
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.dialects.postgresql import UUID
 from datetime import datetime
-import uuid, enum
+import uuid, enum, os, time
 
 models = Blueprint('models', __name__)
 
-db = SQLAlchemy()
+def uuid7():
+    # RFC 9562 UUIDv7: 48-bit Unix millisecond timestamp, version, then 74 random bits.
+    # New keys land at the right-hand edge of the primary key btree instead of a random page.
+    rand = int.from_bytes(os.urandom(10), 'big')
+    value = (time.time_ns() // 1_000_000) << 80
+    value |= 0x7 << 76 | (rand >> 62 & 0xFFF) << 64
+    value |= 0b10 << 62 | rand & (1 << 62) - 1
+    return uuid.UUID(int=value)
+
+# Instances stay loaded after commit; endpoints serialize what they just wrote without a reload SELECT
+db = SQLAlchemy(session_options={'expire_on_commit': False})
+
+# Each model lists the column sets its hot-path queries filter on in query_paths. Every path
+# must be the leading columns of an index declared on the model; migrations.check_indexes()
+# enforces that against both the declarations and the live database.
 
 class TimeStamp(object):
     created_date = db.Column(db.Date, default=datetime.now)
     created_time = db.Column(db.TIME, default=datetime.now)
+    # Sort and keyset pagination key for the list endpoints; set by Postgres and returned by the INSERT
+    created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), nullable=False)
     updated_date = db.Column(db.Date, default=datetime.now, onupdate=datetime.now)
     updated_time = db.Column(db.TIME, default=datetime.now, onupdate=datetime.now)
     created_by = db.Column(db.String, default='app')
@@ -50,7 +66,11 @@ class DimDate(db.Model):
 
 class Company(db.Model, TimeStamp):
     __tablename__ = 'company'
-    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True, nullable=False)
+    __table_args__ = (
+        db.Index('ix_company_name_is_archived', 'name', 'is_archived'),
+    )
+    query_paths = [('name', 'is_archived')]
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid7, nullable=False)
     name = db.Column(db.String(100), nullable=False)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     is_archived = db.Column(db.Boolean, default=False)
@@ -58,9 +78,31 @@ class Company(db.Model, TimeStamp):
     users = db.relationship('User', backref='company', cascade="all, delete-orphan", passive_deletes=True)
     clients = db.relationship('Client', backref='company', cascade="all, delete-orphan", passive_deletes=True)
 
+class CompanyCounter(db.Model):
+    __tablename__ = 'company_counter'
+    company_id = db.Column(UUID(as_uuid=True), db.ForeignKey('company.id', ondelete="CASCADE"), primary_key=True, nullable=False)
+    total_employees = db.Column(db.Integer, default=0, nullable=False)
+    active_employees = db.Column(db.Integer, default=0, nullable=False)
+    total_clients = db.Column(db.Integer, default=0, nullable=False)
+    active_clients = db.Column(db.Integer, default=0, nullable=False)
+    total_projects = db.Column(db.Integer, default=0, nullable=False)
+    active_projects = db.Column(db.Integer, default=0, nullable=False)
+    total_tasks = db.Column(db.Integer, default=0, nullable=False)
+    active_tasks = db.Column(db.Integer, default=0, nullable=False)
+
+    counters = ['total_employees', 'active_employees', 'total_clients', 'active_clients',
+                'total_projects', 'active_projects', 'total_tasks', 'active_tasks']
+
 class User(db.Model, TimeStamp):
     __tablename__ = 'user'
-    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True, nullable=False)
+    __table_args__ = (
+        db.Index('ix_user_company_id_is_archived', 'company_id', 'is_archived'),
+        db.Index('ix_user_approver_id', 'approver_id'),
+        db.Index('ix_user_email', 'email'),
+        db.Index('ix_user_company_id_created_at', 'company_id', 'created_at', 'id'),
+    )
+    query_paths = [('company_id', 'is_archived'), ('approver_id',), ('email',), ('company_id', 'created_at')]
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid7, nullable=False)
     firstname = db.Column(db.String(100), nullable=False)
     lastname = db.Column(db.String(100))
     role = db.Column(db.String(50), nullable=False)
@@ -83,7 +125,12 @@ class User(db.Model, TimeStamp):
 
 class Client(db.Model, TimeStamp):
     __tablename__ = 'client'
-    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True, nullable=False)
+    __table_args__ = (
+        db.Index('ix_client_company_id_is_archived', 'company_id', 'is_archived'),
+        db.Index('ix_client_company_id_created_at', 'company_id', 'created_at', 'id'),
+    )
+    query_paths = [('company_id', 'is_archived'), ('company_id', 'created_at')]
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid7, nullable=False)
     name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(100), nullable=False)
     phone = db.Column(db.String(10))
@@ -95,7 +142,13 @@ class Client(db.Model, TimeStamp):
 
 class Project(db.Model, TimeStamp):            
     __tablename__ = 'project'
-    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True, nullable=False)
+    __table_args__ = (
+        db.Index('ix_project_client_id_is_archived', 'client_id', 'is_archived'),
+        db.Index('ix_project_name_is_archived_client_id', 'name', 'is_archived', 'client_id'),
+    )
+    # Name uniqueness checks: per client on add, across all clients on update
+    query_paths = [('client_id', 'is_archived'), ('name', 'is_archived', 'client_id'), ('name', 'is_archived')]
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid7, nullable=False)
     name = db.Column(db.String(100), nullable=False)
     start_date = db.Column(db.Date)
     end_date = db.Column(db.Date)
@@ -114,7 +167,13 @@ class BillableType(enum.Enum):
 
 class Task(db.Model, TimeStamp):
     __tablename__ = 'task'
-    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True, nullable=False)
+    __table_args__ = (
+        db.Index('ix_task_project_id_is_archived', 'project_id', 'is_archived'),
+        db.Index('ix_task_name_is_archived_project_id', 'name', 'is_archived', 'project_id'),
+    )
+    # Name uniqueness checks: per project on add, across all projects on update
+    query_paths = [('project_id', 'is_archived'), ('name', 'is_archived', 'project_id'), ('name', 'is_archived')]
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid7, nullable=False)
     name = db.Column(db.String(100), nullable=False)
     project_id = db.Column(UUID(as_uuid=True), db.ForeignKey('project.id', ondelete="CASCADE"), nullable=False)
     start_date = db.Column(db.Date)
@@ -134,7 +193,12 @@ class Approval(enum.Enum):
 
 class Timesheet(db.Model, TimeStamp):
     __tablename__ = 'timesheet'
-    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True, nullable=False)
+    __table_args__ = (
+        db.Index('ix_timesheet_user_id_is_archived_approval', 'user_id', 'is_archived', 'approval'),
+        db.Index('ix_timesheet_user_id_created_at', 'user_id', 'created_at', 'id'),
+    )
+    query_paths = [('user_id', 'is_archived', 'approval'), ('user_id', 'is_archived'), ('user_id', 'created_at')]
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid7, nullable=False)
     name = db.Column(db.String(100), nullable=False)
     start_date = db.Column(db.Date, nullable=False)
     end_date = db.Column(db.Date)
@@ -147,7 +211,11 @@ class Timesheet(db.Model, TimeStamp):
 
 class TaskHours(db.Model, TimeStamp):
     __tablename__ = 'taskhours'
-    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True, nullable=False)
+    __table_args__ = (
+        db.Index('ix_taskhours_timesheet_id_is_active', 'timesheet_id', 'is_active'),
+    )
+    query_paths = [('timesheet_id', 'is_active')]
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid7, nullable=False)
     values = db.Column(db.ARRAY(db.Integer), nullable=False, default=lambda: [0] * 7)
     # comments = db.Column(db.ARRAY(db.String), nullable=False, default=lambda: [''] * 7)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
@@ -156,7 +224,7 @@ class TaskHours(db.Model, TimeStamp):
     
 class HistoryLogger(db.Model, TimeStamp):
     __tablename__ = 'history_logger'
-    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True, nullable=False)
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid7, nullable=False)
     table_name = db.Column(db.String(100), nullable=False)
     record_id = db.Column(UUID(as_uuid=True), nullable=False)
     operation = db.Column(db.String(50), nullable=False)
@@ -166,14 +234,31 @@ class HistoryLogger(db.Model, TimeStamp):
 
 class BlacklistToken(db.Model, TimeStamp):
     __tablename__ = 'blacklist_tokens'
-    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True, nullable=False)
-    jti = db.Column(db.String(100), nullable=False)
+    query_paths = [('jti',)]
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid7, nullable=False)
+    jti = db.Column(db.String(100), nullable=False, index=True)
     blacklisted_on = db.Column(db.DateTime, nullable=False, default=datetime.now)
 
 class Token(db.Model, TimeStamp):
     __tablename__ = 'token'
-    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True, nullable=False)
+    query_paths = [('token',)]
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid7, nullable=False)
     user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False)
-    token = db.Column(db.String(255), nullable=False)
+    token = db.Column(db.String(255), nullable=False, index=True)
     token_date = db.Column(db.DateTime(), nullable=False, default=datetime.now)
 
+
+class OutboxMessage(db.Model, TimeStamp):
+    __tablename__ = 'outbox'
+    query_paths = [('next_attempt_on',), ('digest_key',)]
+    __table_args__ = (
+        db.Index('ix_outbox_pending', 'next_attempt_on', postgresql_where=db.text('sent_on IS NULL')),
+    )
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid7, nullable=False)
+    dedup_key = db.Column(db.String(255), nullable=False, unique=True, default=lambda: uuid.uuid4().hex)
+    digest_key = db.Column(db.String(255), index=True)
+    payload = db.Column(db.JSON, nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_on = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    sent_on = db.Column(db.DateTime)
+    last_error = db.Column(db.String)
@@ -1,7 +1,8 @@
 from flask import Blueprint, jsonify, request
-from utils.models import db, BlacklistToken
-from utils.helper import jwt, load_dim_date
-from utils.controller import UserController, ClientController, ProjectController, TaskController, TaskHourController, Controller, TimesheetController, CompanyController, ApproverController, ProfileController, Statastics
+from utils.models import db
+from utils.helper import jwt, load_dim_date, TokenBlocklistHelper, DbHelper, ResponseCacheHelper
+from utils.migrations import run_migrations
+from utils.controller import UserController, ClientController, ProjectController, TaskController, TaskHourController, Controller, TimesheetController, CompanyController, ApproverController, ProfileController, Statastics, MetadataController, ExportController, ImportController
 
 api = Blueprint('routes', __name__)
 
@@ -36,7 +37,11 @@ def revoked_token_callback(jwt_header, jwt_payload):
 @jwt.token_in_blocklist_loader
 def check_if_token_in_blacklist(jwt_header, jwt_payload):
     jti = jwt_payload['jti']
-    return BlacklistToken.query.filter_by(jti=jti).first() is not None
+    return TokenBlocklistHelper().is_revoked(jti)
+
+@api.teardown_app_request
+def flush_history(error):
+    DbHelper().flush_history(error)
 
 @api.route('/')
 def server():
@@ -46,6 +51,7 @@ def server():
 def create_db():
     db.create_all()
     load_dim_date()
+    run_migrations()
     return jsonify({'message': 'Database created and DimDate data loaded successfully'})
 
 @api.route('/dropdb')
@@ -410,66 +416,33 @@ def get_stats():
     except Exception as e:
         return jsonify({'message': str(e)}), 500
     
+@api.route('/cachestats')
+def cache_stats():
+    try:
+        return jsonify({'cache': ResponseCacheHelper().metrics(), 'status': 200})
+    except Exception as e:
+        return jsonify({'message': str(e), 'status': 500}), 500
+
 @api.route('/metadata', methods=['GET'])
 def metadata():
     try:
-        client_controller = ClientController()
-        project_controller = ProjectController()
-        task_controller = TaskController()
-        timesheet_controller = TimesheetController()
-
-        data = {
-            'clients': [],
-            'projects': [],
-            'tasks': [],
-            'timesheets': []
-        }
-
-        try:
-            client_result = client_controller.client_list()
-            if isinstance(client_result, list):
-                data['clients'] = client_result
-            elif hasattr(client_result, 'json') and isinstance(client_result.json, dict):
-                data['clients'] = client_result.json.get('clients', [])
-        except Exception as e:
-            data['clients'] = {'error': str(e)}
-
-        try:
-            project_result = project_controller.project_list()
-            if isinstance(project_result, list):
-                data['projects'] = project_result
-            elif hasattr(project_result, 'json') and isinstance(project_result.json, dict):
-                data['projects'] = project_result.json.get('projects', [])
-        except Exception as e:
-            data['projects'] = {'error': str(e)}
-
-        try:
-            task_result = task_controller.task_list()
-            if isinstance(task_result, list):
-                data['tasks'] = task_result
-            elif hasattr(task_result, 'json') and isinstance(task_result.json, dict):
-                data['tasks'] = task_result.json.get('tasks', [])
-        except Exception as e:
-            data['tasks'] = {'error': str(e)}
-
-        try:
-            timesheet_result = timesheet_controller.timesheet_list()
-            if isinstance(timesheet_result, list):
-                data['timesheets'] = timesheet_result
-            elif hasattr(timesheet_result, 'json') and isinstance(timesheet_result.json, dict):
-                data['timesheets'] = timesheet_result.json.get('timesheets', [])
-        except Exception as e:
-            data['timesheets'] = {'error': str(e)}
-
-        return jsonify({'message': data, 'status': 200}), 200
-
+        metadata = MetadataController()
+        return metadata.metadata()
     except Exception as e:
         return jsonify({'message': str(e)}), 500
 
+@api.route('/export/taskhours', methods=['GET'])
+def export_taskhours():
+    try:
+        export = ExportController()
+        return export.export_taskhours()
+    except Exception as e:
+        return jsonify({'message': str(e)}), 500
 
-
-
-    
-
-
-
+@api.route('/import/<kind>', methods=['POST'])
+def import_rows(kind):
+    try:
+        imports = ImportController()
+        return imports.import_rows(kind)
+    except Exception as e:
+        return jsonify({'message': str(e)}), 500